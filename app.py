@@ -1,291 +1,253 @@
-from urllib.parse import urlparse # <-- Ensure this import exists
-import requests
-import re
-import html
-from urllib.parse import urlparse, parse_qs
-from bs4 import BeautifulSoup
-from flask import Flask, render_template, request, redirect, url_for
+from urllib.parse import urlparse, urlencode # <-- Ensure this import exists
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, stream_with_context
+
+from cache import TTLCache, MemoryBackend
+from offers import to_paise
+from pipeline import (PRICE_HISTORY_STATS_DAYS, add_product_request_listener, cache_groups, canonical_product,
+                      compare_product, compare_product_stages, detect_product, fetch_comparison, history_store, make_product_key,
+                      note_product_request, product_cache, product_data_breaker, product_data_flight, result_to_json, short_link_resolver,
+                      tracker_cache, tracker_page_breaker, tracker_page_flight)
+from ratelimit import TokenBucket
+from product_urls import canonical_product_url
+from watchlist import Watchlist, WatchlistScheduler, acquire_scheduler_lock
+from observability import configure_logging, init_app, render_metrics
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
-
-# --- Constants ---
-USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-REQUEST_TIMEOUT = 15
-
-# --- Helper Functions (ID Extraction, API Fetch, Scraping) ---
-
-def extract_pid_amazon(amazon_url):
-    """Extracts the Product ID (ASIN) from Amazon URL."""
-    match = re.search(r"/(?:dp|gp/product)/([A-Z0-9]{10})", amazon_url)
-    return match.group(1) if match else None
-
-def extract_pid_flipkart(flipkart_url):
-    """Extracts the Product ID (pid) from Flipkart URL query parameters."""
-    try:
-        parsed_url = urlparse(flipkart_url)
-        query_params = parse_qs(parsed_url.query)
-        if 'pid' in query_params and query_params['pid']:
-            return query_params['pid'][0]
-    except Exception:
-        pass
-    match = re.search(r"pid=([A-Z0-9]+)", flipkart_url)
-    return match.group(1) if match else None
-
-def fetch_price_from_buyhatke(product_id, site_type):
+init_app(app) # Server-Timing header and HTTP metrics
+
+# --- Results Page Settings ---
+# Stream the results page: the shell goes out immediately, product info once the
+# BuyHatke API answers, and the alternatives after the tracker page is scraped.
+STREAM_RESULTS = os.environ.get("STREAM_RESULTS", "1") == "1"
+
+# --- Permalink Settings ---
+# Results live at GET /compare?site=...&pid=..., served from a cache of rendered pages
+# with ETags and Cache-Control so browsers, CDNs and proxies can keep them too.
+PAGE_CACHE_TTL = int(os.environ.get("PAGE_CACHE_TTL", 60))  # seconds a rendered page is fresh (its max-age)
+PAGE_CACHE_STALE_TTL = int(os.environ.get("PAGE_CACHE_STALE_TTL", 300))  # extra seconds served stale (stale-while-revalidate)
+PAGE_CACHE_MAX_ENTRIES = int(os.environ.get("PAGE_CACHE_MAX_ENTRIES", 2000))
+PAGE_CACHE_MAX_BYTES = int(os.environ.get("PAGE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# --- Watchlist Settings ---
+WATCHLIST_PATH = os.environ.get("WATCHLIST_PATH", "watchlist.sqlite3")
+WATCHLIST_SCHEDULER_ENABLED = os.environ.get("WATCHLIST_SCHEDULER_ENABLED", "0") == "1"  # one worker per host wins a file lock
+WATCHLIST_WORKERS = int(os.environ.get("WATCHLIST_WORKERS", 4))
+WATCHLIST_REFRESH_INTERVAL = int(os.environ.get("WATCHLIST_REFRESH_INTERVAL", 1800))  # seconds between refreshes of one product
+WATCHLIST_UPSTREAM_RATE = float(os.environ.get("WATCHLIST_UPSTREAM_RATE", 4))  # upstream requests/second for refreshes
+WATCHLIST_DROP_PERCENT = float(os.environ.get("WATCHLIST_DROP_PERCENT", 5))  # drop that triggers an event when no threshold is set
+WATCHLIST_EVENTS_MAX = int(os.environ.get("WATCHLIST_EVENTS_MAX", 500))  # price-drop events kept in the watchlist database
+
+# --- Batch Comparison Settings ---
+COMPARE_MAX_WORKERS = int(os.environ.get("COMPARE_MAX_WORKERS", 16))  # shared by all batch requests in a worker
+COMPARE_MAX_URLS = int(os.environ.get("COMPARE_MAX_URLS", 500))  # per /api/compare request
+COMPARE_ITEM_TIMEOUT = float(os.environ.get("COMPARE_ITEM_TIMEOUT", 40))  # seconds once an item starts running
+COMPARE_BATCH_TIMEOUT = float(os.environ.get("COMPARE_BATCH_TIMEOUT", 120))  # seconds for the whole request
+
+# --- Watchlist ---
+
+watchlist = Watchlist(WATCHLIST_PATH)
+add_product_request_listener(watchlist.note_request)  # Interactive lookups raise refresh priority
+upstream_rate_limiter = TokenBucket(WATCHLIST_UPSTREAM_RATE, burst=max(2, WATCHLIST_UPSTREAM_RATE))
+
+def refresh_watched_product(entry):
     """
-    Fetches price and details from BuyHatke API using product_id and site_type.
-    Returns (product_name, price, tracker_url, thumbnails).
+    Refreshes one watchlist entry from BuyHatke, warming the product cache and the
+    price history snapshot so interactive lookups hit fresh data.
+    Returns (lowest_paise, lowest_seller); raises if BuyHatke failed.
     """
-    if site_type == "amazon":
-        pos = 63
-        site_prefix = "amazon"
-    elif site_type == "flipkart":
-        pos = 2
-        site_prefix = "flipkart"
-    else:
-        print(f"❌ Unsupported site_type: {site_type}")
-        return None, None, None, None
-
-    buyhatke_api_url = f"https://buyhatke.com/api/productData?pos={pos}&pid={product_id}"
-    headers = {"User-Agent": USER_AGENT}
-
-    print(f"ℹ️ Querying BuyHatke API for {site_type.capitalize()} (PID: {product_id}): {buyhatke_api_url}")
-    try:
-        response = requests.get(buyhatke_api_url, headers=headers, timeout=REQUEST_TIMEOUT)
-        response.raise_for_status()
-        data = response.json()
-
-        if data and "data" in data and data["data"] and isinstance(data["data"], dict):
-            product_data = data["data"]
-            product_name = product_data.get("name")
-            price = product_data.get("cur_price")
-            site_pos = product_data.get("site_pos")
-            internal_pid = product_data.get("internalPid")
-            
-            # Extract thumbnail images if available
-            thumbnails = product_data.get("thumbnailImages", [])
-            if not thumbnails and "image" in product_data:
-                # Fallback to main image if thumbnails not available
-                thumbnails = [product_data["image"]]
-
-            if product_name and site_pos is not None and internal_pid:
-                slug = re.sub(r'[^\w-]+', '-', product_name.lower()).strip('-')
-                if not slug: slug = f"product-{internal_pid}"
-                buyhatke_url = f"https://buyhatke.com/{site_prefix}-{slug}-price-in-india-{site_pos}-{internal_pid}"
-
-                if not buyhatke_url.startswith("https://buyhatke.com/"):
-                     print(f"⚠️ Warning: Generated BuyHatke URL seems invalid: {buyhatke_url}")
-                     return product_name, price, None, thumbnails
-                return product_name, price, buyhatke_url, thumbnails
-            else:
-                 print(f"⚠️ Warning: Missing required fields in API response data for {site_type} pid={product_id}.")
-                 return product_name, price, None, thumbnails # Return partial data if available
-        else:
-            print(f"❌ API response structure unexpected for {site_type} pid={product_id}.")
-            print(f"   Response: {str(data)[:200]}...")
-            return None, None, None, None
-
-    except requests.exceptions.Timeout:
-        print(f"❌ Timeout fetching data from BuyHatke API for {site_type} pid={product_id}.")
-        return None, None, None, None
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Error fetching data from BuyHatke API: {e}")
-        return None, None, None, None
-    except ValueError as e: # JSON decode error
-        print(f"❌ Error decoding JSON response from BuyHatke API: {e}")
-        if 'response' in locals() and response:
-             print(f"   Raw Response Text: {response.text[:200]}...")
-        return None, None, None, None
-
-# MODIFIED: Returns list of dicts or None/[]
-def scrape_buyhatke_alternatives(tracker_url):
+    url = entry["url"]
+    result, upstream_failed = fetch_comparison(url, entry["site_type"], entry["product_id"],
+                                               urlparse(url).netloc.lower(), refresh=True)
+    if upstream_failed:
+        raise RuntimeError(result["error"])
+    if history_store:
+        history_store.record(entry["product_key"], result)
+
+    lowest = result["lowest_price_option"]
+    if lowest:
+        return lowest.price_paise, lowest.seller
+    return to_paise(result["product_info"].get("price_numeric")), entry["site_type"].capitalize()
+
+watchlist_scheduler = WatchlistScheduler(
+    watchlist, refresh_watched_product, upstream_rate_limiter,
+    workers=WATCHLIST_WORKERS, refresh_interval=WATCHLIST_REFRESH_INTERVAL, drop_percent=WATCHLIST_DROP_PERCENT,
+    events_retention=WATCHLIST_EVENTS_MAX,
+)
+
+def start_watchlist_scheduler():
+    """Starts the scheduler unless another process on this host already runs it."""
+    global _scheduler_lock
+    _scheduler_lock = acquire_scheduler_lock(f"{WATCHLIST_PATH}.lock")
+    if _scheduler_lock is None:
+        logger.info("Watchlist scheduler already running in another process")
+        return False
+    watchlist_scheduler.start()
+    return True
+
+_scheduler_lock = None
+if WATCHLIST_SCHEDULER_ENABLED:
+    start_watchlist_scheduler()
+
+# --- Batch Comparison ---
+
+compare_executor = ThreadPoolExecutor(max_workers=COMPARE_MAX_WORKERS, thread_name_prefix="compare")
+
+def compare_products(urls, item_timeout=COMPARE_ITEM_TIMEOUT, batch_timeout=COMPARE_BATCH_TIMEOUT):
     """
-    Downloads the BuyHatke tracker page and scrapes alternative prices.
-    Returns a list of dictionaries, each containing seller, title, price, link.
-    Returns None on download/parsing error, empty list if no items found.
+    Runs compare_product for every URL on the shared bounded thread pool.
+    Returns one JSON-ready dict per URL, in input order. Items that run longer than
+    item_timeout, or are still pending when batch_timeout expires, are reported with
+    status "timeout" instead of holding up the rest of the batch.
     """
-    if not tracker_url or not tracker_url.startswith("http"):
-        print("ℹ️ Invalid or missing tracker URL provided. Cannot scrape alternatives.")
-        return None # Indicate error
-
-    print(f"\n⏬ Downloading BuyHatke page: {tracker_url}")
-    headers = {"User-Agent": USER_AGENT}
-    results = [] # Initialize list to store results
-
-    try:
-        response = requests.get(tracker_url, headers=headers, timeout=REQUEST_TIMEOUT)
-        response.raise_for_status()
-        print(f"✅ HTML Downloaded Successfully (Status: {response.status_code})")
-
-        soup = BeautifulSoup(response.text, 'html.parser') # Use html.parser or html5lib
-
-        # --- Find the price list (robust finding logic) ---
-        price_list = None
-        # Try specific ID first
-        price_section_by_id = soup.find('section', id='onlineStoresList')
-        if price_section_by_id:
-            price_list = price_section_by_id.find('ul', class_=re.compile(r'my-4 grid'))
-
-        # Try common structure/text if ID fails
-        if not price_list:
-            price_section_by_text = soup.find('section', class_='grid', string=lambda t: t and "Found" in t and "more prices" in t)
-            if price_section_by_text:
-                price_list = price_section_by_text.find('ul', class_=re.compile(r'my-4 grid'))
-
-        # Generic fallback if specific methods fail
-        if not price_list:
-            all_lists = soup.find_all('ul', class_=re.compile(r'my-4 grid'))
-            # Add logic here if needed to distinguish the correct list if multiple match
-            if all_lists:
-                 price_list = all_lists[0] # Assume the first one is correct for now
-
-        # --- Process list items ---
-        if not price_list:
-            print("❌ Could not find the list (<ul>) of alternative prices. Scraping patterns might need update.")
-            # Try dumping some HTML to debug if needed:
-            # with open("debug_page.html", "w", encoding="utf-8") as f:
-            #     f.write(response.text)
-            # print("Saved debug_page.html")
-            return [] # Return empty list, not an error, just no items found
-
-        list_items = price_list.find_all('li', recursive=False)
-
-        if not list_items:
-            print("ℹ️ No alternative price list items (<li>) found within the list.")
-            return [] # Return empty list
-
-        print(f"\n🛒 Found {len(list_items)} Alternative Prices:")
-
-        for item in list_items:
-            seller_name = "N/A"
-            product_title = "N/A"
-            price_str = "N/A"
-            buy_link = "#" # Default link to avoid errors
-
-            # Seller Name Extraction
-            img_container = item.find('div', class_=re.compile(r'\bflex\b.*\bitems-center\b'))
-            if img_container:
-                 img_tag = img_container.find('img', class_=re.compile(r'\brounded-full\b'), alt=True)
-                 if img_tag and img_tag.get('alt'):
-                      seller_name = img_tag['alt'].strip()
-            if seller_name == "N/A" and img_container: # Fallback to src parsing
-                img_tag = img_container.find('img', class_=re.compile(r'\brounded-full\b'), src=True)
-                if img_tag:
-                    src_url = img_tag.get('src', '')
-                    match = re.search(r'/([^/]+?)(?:1|_m)?\.(?:png|jpe?g|webp|svg)', src_url, re.IGNORECASE)
-                    if match:
-                        raw_name = match.group(1)
-                        seller_name = raw_name.replace('-', ' ').replace('_', ' ').title()
-                        corrections = {'Vsales': 'Vijay Sales', 'Flipkart': 'Flipkart', 'Amazon': 'Amazon', 'Jiomart' : 'JioMart', 'Reliancedigital': 'Reliance Digital', 'Tatacliq': 'Tata CLiQ', 'Croma': 'Croma'}
-                        seller_name = corrections.get(seller_name, seller_name)
-
-            # Product Title Extraction
-            title_p_tag = item.find('p', title=True)
-            if title_p_tag: product_title = html.unescape(title_p_tag['title'].strip())
-            else:
-                 title_p_tag = item.find('p', class_='capitalize')
-                 if title_p_tag:
-                      # Prioritize the longer title if available (often more complete)
-                      span_hidden_md = title_p_tag.find('span', class_='hidden md:inline')
-                      span_md_hidden = title_p_tag.find('span', class_='md:hidden')
-                      if span_hidden_md and len(span_hidden_md.get_text(strip=True)) > 5 : # Check length as heuristic
-                           product_title = html.unescape(span_hidden_md.get_text(strip=True))
-                      elif span_md_hidden:
-                           product_title = html.unescape(span_md_hidden.get_text(strip=True))
-                      else: # Fallback to the whole paragraph text
-                           product_title = html.unescape(title_p_tag.get_text(strip=True))
-
-            # Price Extraction
-            price_container = item.find('div', class_=re.compile(r'flex justify-between'))
-            if price_container:
-                price_span = price_container.find('span', class_='font-bold')
-                if price_span:
-                    raw_price = price_span.get_text(strip=True)
-                    price_match = re.search(r'([\d,]+(?:\.\d+)?)', raw_price)
-                    if price_match: price_str = f"₹{price_match.group(1)}"
-                    else: price_str = raw_price
-                else:
-                    price_p_tag = price_container.find('p', string=re.compile(r'₹'))
-                    if price_p_tag:
-                         raw_price = price_p_tag.get_text(strip=True)
-                         price_match = re.search(r'₹\s*([\d,]+(?:\.\d+)?)', raw_price)
-                         if price_match: price_str = f"₹{price_match.group(1)}"
-                         else: price_str = raw_price
-
-            # Buy Link Extraction
-            # Look within price container first
-            if price_container:
-                buy_a_tag = price_container.find('a', href=True, class_=re.compile(r'\btext-primary\b'))
-                if not buy_a_tag: buy_a_tag = price_container.find('a', href=True, string=re.compile(r'Buy'))
-                if buy_a_tag: buy_link = buy_a_tag['href']
-
-            # Fallback: Search entire list item if not found above
-            if buy_link == "#": # Use default value check
-                buy_a_tag = item.find('a', href=True, string=re.compile(r'Buy'))
-                if buy_a_tag: buy_link = buy_a_tag['href']
-
-            # Resolve relative URLs
-            if buy_link.startswith('/'):
-                 buy_link = requests.compat.urljoin(tracker_url, buy_link)
-
-            # Final Fallback: Seller from Buy Link Hostname
-            if seller_name == "N/A" and buy_link != "#" and buy_link.startswith("http"):
-                try:
-                    target_url = buy_link
-                    parsed_buy_link = urlparse(buy_link)
-                    if 'tracking.buyhatke.com' in parsed_buy_link.netloc:
-                        query_params = parse_qs(parsed_buy_link.query)
-                        if 'link' in query_params and query_params['link']:
-                            target_url = query_params['link'][0]
-                    parsed_target_url = urlparse(target_url)
-                    hostname = parsed_target_url.netloc.lower()
-                    if 'amazon.in' in hostname or 'amazon.com' in hostname: seller_name = 'Amazon'
-                    elif 'flipkart.com' in hostname: seller_name = 'Flipkart'
-                    elif 'croma.com' in hostname: seller_name = 'Croma'
-                    elif 'jiomart.com' in hostname: seller_name = 'JioMart'
-                    elif 'vijaysales.com' in hostname: seller_name = 'Vijay Sales'
-                    elif 'reliancedigital.in' in hostname: seller_name = 'Reliance Digital'
-                    elif 'tatacliq.com' in hostname: seller_name = 'Tata CLiQ'
-                    elif 'shopclues.com' in hostname: seller_name = 'ShopClues'
-                    elif 'paytmmall.com' in hostname: seller_name = 'Paytm Mall'
-                except Exception:
-                    pass
-
-            # Append result if valid data found
-            if price_str != "N/A" or seller_name != "N/A": # Basic check if we extracted *something* useful
-                results.append({
-                    "seller": seller_name,
-                    "title": product_title,
-                    "price": price_str,
-                    "link": buy_link
-                })
-
-        return results
-
-    except requests.exceptions.Timeout:
-        print(f"❌ Timeout downloading BuyHatke page HTML: {tracker_url}")
-        return None # Indicate download error
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Error downloading BuyHatke page HTML: {e}")
-        return None # Indicate download error
-    except Exception as e:
-        print(f"❌ An unexpected error occurred during scraping: {e}")
-        import traceback
-        traceback.print_exc()
-        return None # Indicate scraping error
+    started = {}
+    started_lock = threading.Lock()
+
+    def run(index, input_url):
+        with started_lock:
+            started[index] = time.monotonic()
+        return compare_product(input_url)
+
+    futures = {compare_executor.submit(run, i, url): i for i, url in enumerate(urls)}
+    results = [None] * len(urls)
+    pending = set(futures)
+    batch_deadline = time.monotonic() + batch_timeout
+
+    while pending:
+        done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+        for future in done:
+            i = futures[future]
+            try:
+                results[i] = result_to_json(urls[i], future.result())
+            except Exception as e:
+                results[i] = {"url": urls[i], "status": "error", "error": f"Unexpected error: {e}"}
+
+        now = time.monotonic()
+        for future in list(pending):
+            i = futures[future]
+            with started_lock:
+                started_at = started.get(i)
+            item_expired = started_at is not None and now - started_at > item_timeout
+            if item_expired or now > batch_deadline:
+                future.cancel()  # Only stops items that have not started; running ones finish in the background.
+                pending.discard(future)
+                results[i] = {"url": urls[i], "status": "timeout", "error": "Timed out waiting for comparison."}
+
+    return results
 
 # --- Flask Routes ---
 
+# --- Permalinks ---
+# A cached page is (body bytes, strong ETag, cacheable). Results with an error or a
+# degraded-mode notice are sent with no-cache and not stored, so the next view retries.
+
+PERMALINK_MIMETYPES = {"html": "text/html", "json": "application/json"}
+
+page_cache = TTLCache(MemoryBackend(max_entries=PAGE_CACHE_MAX_ENTRIES, max_bytes=PAGE_CACHE_MAX_BYTES),
+                      ttl=PAGE_CACHE_TTL, stale_ttl=PAGE_CACHE_STALE_TTL, cacheable=lambda page: page[2])
+cache_groups["rendered_page"] = page_cache
+
+def permalink_url(site_type, product_id, fmt="html"):
+    query = {"site": site_type, "pid": product_id}
+    if fmt != "html":
+        query["format"] = fmt
+    return f"/compare?{urlencode(query)}"
+
+def permalink_product(site_type, product_id):
+    """
+    Validates permalink query parameters. Returns (site_type, product_id, error), the
+    first two spelled canonically (e.g. an upper-cased ASIN).
+    """
+    if site_type not in ("amazon", "flipkart") or not product_id:
+        return None, None, "Query parameters 'site' (amazon or flipkart) and 'pid' are required."
+    return canonical_product(site_type, product_id)
+
+def page_cache_key(site_type, product_id, fmt):
+    return f"{make_product_key(site_type, product_id)}:{fmt}"
+
+def make_page(body, result):
+    body = body.encode("utf-8")
+    etag = '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+    return body, etag, not result["error"] and not result["notice"]
+
+def render_permalink_page(input_url, result, fmt):
+    """A page for a finished comparison. Needs no request, so stale pages can be re-rendered in the background."""
+    if fmt == "json":
+        return make_page(app.json.dumps(result_to_json(input_url, result)), result)
+    with app.test_request_context("/compare"):
+        return make_page(render_template('index.html', input_url=input_url, results_page=True, **result), result)
+
+def page_headers(page):
+    if page[2]:
+        cache_control = f"public, max-age={PAGE_CACHE_TTL}, stale-while-revalidate={PAGE_CACHE_STALE_TTL}"
+    else:
+        cache_control = "no-cache"
+    return {"ETag": page[1], "Cache-Control": cache_control}
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match check; the comparison is weak, as RFC 9110 specifies for this header."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def page_response(page, fmt):
+    headers = page_headers(page)
+    if etag_matches(request.headers.get('If-None-Match'), page[1]):
+        return Response(status=304, headers=headers)
+    return Response(page[0], mimetype=PERMALINK_MIMETYPES[fmt], headers=headers)
+
+# --- Streamed Results Page ---
+
+STREAM_RESULTS_MARKER = "<!--stream:results-->"
+
+def render_sections(sections, result):
+    return "".join(render_template(f"partials/{section}.html", **result) for section in sections)
+
+def stream_results_page(input_url, cache_key):
+    """
+    Yields the results page in chunks: the page shell straight away, product info as
+    soon as the BuyHatke API answers, then alternatives, the lowest-price card and
+    price history once the tracker page has been scraped. The finished page goes into
+    page_cache under cache_key.
+    """
+    head, tail = render_template('index.html', input_url=input_url, results_page=True,
+                                 streaming=True).split(STREAM_RESULTS_MARKER, 1)
+    chunks = [head]
+    yield head
+    product_sent = False
+    for stage, result in compare_product_stages(input_url, note_request=False):
+        chunks.append(render_sections(stage_sections(stage, product_sent), result))
+        yield chunks[-1]
+        product_sent = product_sent or stage == "product"
+    chunks.append(tail)
+    yield tail
+    page = make_page("".join(chunks), result)
+    if page_cache.cacheable(page):
+        page_cache.set(cache_key, page)
+
+def stage_sections(stage, product_sent):
+    """The partials to send for a compare_product_stages stage (also used by async_app)."""
+    if stage == "product":
+        return ("messages", "product_info")
+    sections = ("alternatives", "lowest_price", "price_history")
+    if not product_sent:
+        sections = ("product_info",) + sections
+    # Errors and notices only known after the scrape go above the alternatives.
+    return ("messages",) + sections
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
-    error = None
-    product_info = None
-    alternatives = None
-    lowest_price_option = None
-    site_type = None
-    product_id = None
-    tracker_url = None
     input_url = "" # Keep track of the submitted URL
 
     if request.method == 'POST':
@@ -293,139 +255,166 @@ def index():
         if not input_url:
             error = "Please enter a product URL."
             # Pass input_url back even on immediate error
-            return render_template('index.html', error=error, input_url=input_url)
-
-        print(f"\nProcessing URL: {input_url}")
-
-        # Detect Site and Extract ID
-        original_domain = "N/A" # Default value
-        try:
-            parsed_url = urlparse(input_url)
-            domain = parsed_url.netloc.lower()
-            original_domain = domain # Store the extracted domain
-
-            if "amazon." in domain:
-                site_type = "amazon"
-                product_id = extract_pid_amazon(input_url)
-                id_type = "ASIN"
-            elif "flipkart.com" in domain:
-                site_type = "flipkart"
-                product_id = extract_pid_flipkart(input_url)
-                id_type = "PID"
-            else:
-                error = "URL does not appear to be a valid Amazon or Flipkart link."
-                site_type = None # Prevent further processing
-
-        except Exception as e:
-            error = f"Error parsing input URL: {e}"
-            site_type = None # Prevent further processing
-
-        # Proceed if site detected and ID extracted
-        if site_type and product_id:
-            print(f"✅ Detected {site_type.capitalize()} URL. Extracted {id_type}: {product_id}")
-
-            # Fetch initial details from BuyHatke API
-            api_name, api_price, tracker_url, thumbnails = fetch_price_from_buyhatke(product_id, site_type)
-
-            if api_name is not None or api_price is not None:
-                price_display = 'N/A'
-                original_price_numeric = None
-                
-                if api_price is not None:
-                    try:
-                        original_price_numeric = float(api_price)
-                        price_display = f"₹{original_price_numeric:,.2f}"
-                    except (ValueError, TypeError):
-                        price_display = f"₹{api_price}"
-
-                # Include the extracted domain in product_info
-                product_info = {
-                    "name": api_name or "N/A",
-                    "price": price_display,
-                    "price_numeric": original_price_numeric,
-                    "tracker_url": tracker_url,
-                    "original_url": input_url,
-                    "original_domain": original_domain,
-                    "site_type": site_type,
-                    "thumbnails": thumbnails
-                }
-
-                if tracker_url:
-                    # Scrape alternatives
-                    alternatives = scrape_buyhatke_alternatives(tracker_url)
-                    if alternatives is None:
-                        error = "Could not fetch alternative prices (scraping error)."
-                        alternatives = []
-                    elif not alternatives:
-                        print("ℹ️ No alternative prices found on the tracker page.")
-                    else:
-                        # Find the lowest price option among all options (including original)
-                        lowest_price = float('inf')
-                        lowest_price_item = None
-                        
-                        # Process price strings to extract numeric values for comparison
-                        for item in alternatives:
-                            if item['price'] != 'N/A':
-                                # Extract numeric price value using regex
-                                price_match = re.search(r'₹\s*([\d,]+(?:\.\d+)?)', item['price'])
-                                if price_match:
-                                    # Remove commas and convert to float
-                                    try:
-                                        price_val = float(price_match.group(1).replace(',', ''))
-                                        item['price_numeric'] = price_val
-                                        
-                                        if price_val < lowest_price:
-                                            lowest_price = price_val
-                                            lowest_price_item = item
-                                    except (ValueError, TypeError):
-                                        continue
-                        
-                        # Compare with original price
-                        if original_price_numeric is not None:
-                            if original_price_numeric < lowest_price:
-                                lowest_price = original_price_numeric
-                                lowest_price_item = {
-                                    'seller': site_type.capitalize(),
-                                    'price': price_display,
-                                    'price_numeric': original_price_numeric,
-                                    'link': input_url,
-                                    'is_original': True
-                                }
-                            
-                        # Set the lowest price option
-                        if lowest_price_item:
-                            lowest_price_option = lowest_price_item
-                            print(f"✅ Lowest price found: {lowest_price_item['seller']} - {lowest_price_item['price']}")
-                else:
-                    error = "Could not construct BuyHatke tracker URL. Cannot fetch alternatives."
-                    alternatives = [] # Ensure alternatives is iterable
-
-            else:
-                error = f"Failed to fetch initial details for {product_id} from BuyHatke API. Product might not be tracked or API issue."
-                # Pass back basic info even on failure
-                product_info = {
-                    "original_url": input_url,
-                    "original_domain": original_domain
-                }
-                alternatives = [] # Ensure alternatives is iterable
-
-        elif site_type and not product_id:
-            error = f"Could not extract Product ID ({'ASIN' if site_type == 'amazon' else 'PID'}) from the {site_type.capitalize()} URL. Please check the link."
-        elif not site_type and not error: # URL was invalid or unsupported
-            if not error: # If no specific error set yet
-                error = "Could not process the provided URL. Please ensure it's a valid Amazon or Flipkart product link."
-
-        # Render the template with results or errors
-        return render_template('index.html',
-                              error=error,
-                              product_info=product_info,
-                              alternatives=alternatives,
-                              lowest_price_option=lowest_price_option,
-                              input_url=input_url) # Pass URL back to prefill input
+            return render_template('index.html', error=error, input_url=input_url, results_page=True)
+
+        site_type, product_id, _, error = detect_product(input_url)
+        if error:
+            return render_template('index.html', error=error, input_url=input_url, results_page=True)
+        # Results live at the product's permalink, so repeat views come from the page cache.
+        return redirect(permalink_url(site_type, product_id), code=303)
 
     # For GET requests
     return render_template('index.html', input_url=input_url) # Pass empty input_url initially
 
+@app.route('/compare')
+def compare_permalink():
+    """
+    Cacheable results page for one product; the form POST redirects here.
+    Query: ?site=amazon&pid=B0...&format=json (format defaults to html)
+    """
+    requested = (request.args.get('site', '').lower(), request.args.get('pid', '').strip())
+    fmt = request.args.get('format', 'html')
+    site_type, product_id, error = permalink_product(*requested)
+    if fmt not in PERMALINK_MIMETYPES:
+        error = "Query parameter 'format' must be html or json."
+    if error:
+        if fmt == "json":
+            return jsonify({"error": error}), 400
+        return render_template('index.html', error=error, input_url="", results_page=True), 400
+    if (site_type, product_id) != requested:
+        return redirect(permalink_url(site_type, product_id, fmt), code=301)
+
+    # Counted here, as cache hits never reach the comparison (watchlist popularity).
+    note_product_request(site_type, product_id)
+    key = page_cache_key(site_type, product_id, fmt)
+    input_url = canonical_product_url(site_type, product_id)
+    load = lambda: render_permalink_page(input_url, compare_product(input_url, note_request=False), fmt)
+    if fmt == "html" and STREAM_RESULTS:
+        page = page_cache.get(key, load)
+        if page is None:
+            # First view: streamed without an ETag; the finished page is cached for the next one.
+            # X-Accel-Buffering stops nginx from holding back the early chunks.
+            return Response(stream_with_context(stream_results_page(input_url, key)), mimetype="text/html",
+                            headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"})
+    else:
+        page = page_cache.get_or_load(key, load)
+    return page_response(page, fmt)
+
+@app.route('/api/compare', methods=['POST'])
+def api_compare():
+    """
+    Batch comparison. Body: {"urls": ["https://www.amazon.in/dp/...", ...]}.
+    Returns {"results": [...]} in input order, with partial results on per-item failures.
+    """
+    payload = request.get_json(silent=True)
+    urls = payload.get("urls") if isinstance(payload, dict) else None
+    if not isinstance(urls, list) or not urls or not all(isinstance(u, str) for u in urls):
+        return jsonify({"error": "Request body must be JSON with a non-empty 'urls' list of strings."}), 400
+    if len(urls) > COMPARE_MAX_URLS:
+        return jsonify({"error": f"Too many URLs; the limit is {COMPARE_MAX_URLS} per request."}), 413
+
+    results = compare_products([u.strip() for u in urls])
+    summary = {status: sum(1 for r in results if r["status"] == status) for status in ("ok", "error", "timeout")}
+    return jsonify({"results": results, "summary": summary})
+
+@app.route('/api/history')
+def api_history():
+    """Per-seller min/max/avg price history. Query: ?site=amazon&pid=B0...&days=30"""
+    site_type = request.args.get('site', '').lower()
+    product_id = request.args.get('pid', '').strip()
+    if site_type not in ("amazon", "flipkart") or not product_id:
+        return jsonify({"error": "Query parameters 'site' (amazon or flipkart) and 'pid' are required."}), 400
+    site_type, product_id, error = canonical_product(site_type, product_id)
+    if error:
+        return jsonify({"error": error}), 400
+    if not history_store:
+        return jsonify({"error": "Price history is disabled."}), 404
+    days = request.args.get('days', PRICE_HISTORY_STATS_DAYS, type=int)
+    product_key = make_product_key(site_type, product_id)
+    return jsonify({"product_key": product_key, "days": days, "sellers": history_store.seller_stats(product_key, days)})
+
+@app.route('/api/watchlist', methods=['GET'])
+def api_watchlist():
+    """Lists watched products. Query: ?limit=1000&offset=0"""
+    limit = max(1, min(request.args.get('limit', 1000, type=int), 10000))  # SQLite reads a negative LIMIT as no limit
+    offset = max(0, request.args.get('offset', 0, type=int))
+    return jsonify({"count": watchlist.count(), "entries": watchlist.entries(limit, offset)})
+
+@app.route('/api/watchlist', methods=['POST'])
+def api_watchlist_add():
+    """
+    Adds a product. Body: {"url": "..."} or {"site": "amazon", "pid": "..."},
+    plus an optional "threshold" in rupees for price-drop events.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({"error": "Request body must be a JSON object."}), 400
+    if payload.get("url"):
+        url = str(payload["url"]).strip()
+        site_type, product_id, _, error = detect_product(url)
+        if error:
+            return jsonify({"error": error}), 400
+    else:
+        site_type = str(payload.get("site", "")).lower()
+        product_id = str(payload.get("pid", "")).strip()
+        if site_type not in ("amazon", "flipkart") or not product_id:
+            return jsonify({"error": "Provide 'url', or 'site' (amazon or flipkart) and 'pid'."}), 400
+        site_type, product_id, error = canonical_product(site_type, product_id)
+        if error:
+            return jsonify({"error": error}), 400
+        url = canonical_product_url(site_type, product_id)
+
+    threshold_paise = None
+    if payload.get("threshold") is not None:
+        threshold_paise = to_paise(payload["threshold"])
+        if threshold_paise is None:
+            return jsonify({"error": "'threshold' must be a number (rupees)."}), 400
+
+    product_key = make_product_key(site_type, product_id)
+    watchlist.add(product_key, site_type, product_id, url, threshold_paise)
+    return jsonify(watchlist.get(product_key)), 201
+
+@app.route('/api/watchlist/<site_type>/<product_id>', methods=['DELETE'])
+def api_watchlist_remove(site_type, product_id):
+    product_key = None
+    if site_type.lower() in ("amazon", "flipkart"):
+        site_type, product_id, error = canonical_product(site_type.lower(), product_id)
+        product_key = None if error else make_product_key(site_type, product_id)
+    if product_key is None or not watchlist.remove(product_key):
+        return jsonify({"error": "Product is not on the watchlist."}), 404
+    return '', 204
+
+@app.route('/api/watchlist/events')
+def api_watchlist_events():
+    """Recent price-drop events from the watchlist database, whichever process ran the scheduler."""
+    return jsonify({"scheduler_running": _scheduler_lock is not None, "events": watchlist.recent_events(WATCHLIST_EVENTS_MAX)})
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus exposition of stage timings, upstream latency/errors and cache counters."""
+    return render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@app.route('/api/cache-stats')
+def cache_stats():
+    """Hit/miss/eviction counters for the product data cache, plus tracker page, short link, rendered page and coalescing counts."""
+    stats = product_cache.stats()
+    stats["short_links"] = short_link_resolver.cache.stats()
+    if tracker_cache:
+        stats["tracker_pages"] = tracker_cache.stats()
+    stats["rendered_pages"] = page_cache.stats()
+    stats["coalescing"] = {
+        "product_data": product_data_flight.stats(),
+        "tracker_page": tracker_page_flight.stats(),
+    }
+    return jsonify(stats)
+
+@app.route('/api/health')
+def health():
+    """Upstream circuit breaker state; "degraded" while any circuit is not closed."""
+    breakers = {b.endpoint: b.snapshot() for b in (product_data_breaker, tracker_page_breaker)}
+    degraded = any(snap["state"] != "closed" for snap in breakers.values())
+    return jsonify({"status": "degraded" if degraded else "ok", "upstreams": breakers})
+
 # Make sure urlparse is imported at the top
 # --- Run the App ---
 if __name__ == '__main__':
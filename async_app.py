@@ -0,0 +1,239 @@
+import argparse
+import asyncio
+import os
+import time
+
+# Hundreds of comparisons share one process here, so allow that many upstream calls
+# per endpoint before the circuit breakers start shedding. Read when pipeline is imported.
+os.environ.setdefault("UPSTREAM_MAX_IN_FLIGHT", "512")
+
+from flask import render_template  # noqa: E402
+from werkzeug.test import EnvironBuilder, run_wsgi_app  # noqa: E402
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+import async_pipeline  # noqa: E402
+from app import (COMPARE_BATCH_TIMEOUT, COMPARE_ITEM_TIMEOUT, COMPARE_MAX_URLS, PERMALINK_MIMETYPES, STREAM_RESULTS,
+                 STREAM_RESULTS_MARKER, app as flask_app, etag_matches, make_page, page_cache, page_cache_key,
+                 page_headers, permalink_product, permalink_url, render_permalink_page, render_sections,
+                 stage_sections)
+from observability import HTTP_REQUESTS, HTTP_SECONDS  # noqa: E402
+from pipeline import detect_product, note_product_request, result_to_json  # noqa: E402
+from product_urls import canonical_product_url  # noqa: E402
+
+# --- Async Server Mode ---
+# An aiohttp entry point for the hot paths, the results page (/compare permalinks)
+# and /api/compare, which await async_pipeline instead of blocking a worker per upstream
+# round-trip. Every other route is passed to the Flask app (app.py) on a thread, so
+# both modes serve the same site. The sync mode (gunicorn app:app) is unchanged.
+#
+#   python async_app.py --port 8000
+#   gunicorn async_app:create_app --worker-class aiohttp.GunicornWebWorker --workers 2
+
+# --- Settings ---
+ASYNC_COMPARE_CONCURRENCY = int(os.environ.get("ASYNC_COMPARE_CONCURRENCY", 256))  # comparisons in flight per process
+
+# --- Rendering ---
+# Templates are the Flask app's; they render on a thread inside a request context
+# (index.html reads request.method and url_for).
+
+def _in_page_context(method, func, *args, **kwargs):
+    with flask_app.test_request_context("/", method=method):
+        return func(*args, **kwargs)
+
+async def render(method, func, *args, **kwargs):
+    return await asyncio.to_thread(_in_page_context, method, func, *args, **kwargs)
+
+async def page_response(method, status=200, **context):
+    html = await render(method, render_template, "index.html", **context)
+    return web.Response(text=html, content_type="text/html", status=status)
+
+def cached_page_response(request, page, fmt):
+    """Async app.page_response."""
+    headers = page_headers(page)
+    if etag_matches(request.headers.get("If-None-Match"), page[1]):
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=page[0], content_type=PERMALINK_MIMETYPES[fmt], charset="utf-8", headers=headers)
+
+async def stream_results_page(request, input_url, cache_key):
+    """Async app.stream_results_page: the same chunks, written as the stages complete, and cached."""
+    response = web.StreamResponse(headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"})
+    response.content_type = "text/html"
+    response.charset = "utf-8"
+    await response.prepare(request)
+    page = await render("GET", render_template, "index.html", input_url=input_url, results_page=True, streaming=True)
+    head, tail = page.split(STREAM_RESULTS_MARKER, 1)
+    chunks = [head]
+    await response.write(head.encode())
+    product_sent = False
+    async for stage, result in async_pipeline.compare_product_stages(input_url, note_request=False):
+        chunks.append(await render("GET", render_sections, stage_sections(stage, product_sent), result))
+        await response.write(chunks[-1].encode())
+        product_sent = product_sent or stage == "product"
+    chunks.append(tail)
+    await response.write(tail.encode())
+    await response.write_eof()
+    page = make_page("".join(chunks), result)
+    if page_cache.cacheable(page):
+        page_cache.set(cache_key, page)
+    return response
+
+# --- Routes ---
+
+async def index(request):
+    if request.method == "POST":
+        form = await request.post()
+        input_url = form.get("product_url", "").strip()
+        if not input_url:
+            return await page_response("POST", error="Please enter a product URL.", input_url=input_url,
+                                       results_page=True)
+        # Short links are resolved with a blocking HEAD request (cached per link).
+        site_type, product_id, _, error = await asyncio.to_thread(detect_product, input_url)
+        if error:
+            return await page_response("POST", error=error, input_url=input_url, results_page=True)
+        raise web.HTTPSeeOther(permalink_url(site_type, product_id))
+    return await page_response("GET", input_url="")
+
+async def compare_permalink(request):
+    """Async app.compare_permalink: the same page cache, headers and redirects."""
+    requested = (request.query.get("site", "").lower(), request.query.get("pid", "").strip())
+    fmt = request.query.get("format", "html")
+    site_type, product_id, error = permalink_product(*requested)  # canonical URLs need no network
+    if fmt not in PERMALINK_MIMETYPES:
+        error = "Query parameter 'format' must be html or json."
+    if error:
+        if fmt == "json":
+            return web.json_response({"error": error}, status=400)
+        return await page_response("GET", status=400, error=error, input_url="", results_page=True)
+    if (site_type, product_id) != requested:
+        raise web.HTTPMovedPermanently(permalink_url(site_type, product_id, fmt))
+
+    note_product_request(site_type, product_id)  # cache hits never reach the comparison
+    key = page_cache_key(site_type, product_id, fmt)
+    input_url = canonical_product_url(site_type, product_id)
+
+    async def load():
+        result = await async_pipeline.compare_product(input_url, note_request=False)
+        return await asyncio.to_thread(render_permalink_page, input_url, result, fmt)
+
+    if fmt == "html" and STREAM_RESULTS:
+        page = page_cache.get(key, load, in_task=True)
+        if page is None:
+            return await stream_results_page(request, input_url, key)
+    else:
+        page = await page_cache.get_or_load_async(key, load)
+    return cached_page_response(request, page, fmt)
+
+_compare_slots = None
+
+async def _compare_one(input_url):
+    async with _compare_slots:
+        try:
+            result = await asyncio.wait_for(async_pipeline.compare_product(input_url), COMPARE_ITEM_TIMEOUT)
+            return result_to_json(input_url, result)
+        except asyncio.TimeoutError:
+            return {"url": input_url, "status": "timeout", "error": "Timed out waiting for comparison."}
+        except Exception as e:
+            return {"url": input_url, "status": "error", "error": f"Unexpected error: {e}"}
+
+async def api_compare(request):
+    """Async app.api_compare: same body, limits and response shape."""
+    try:
+        payload = await request.json()
+    except ValueError:
+        payload = None
+    urls = payload.get("urls") if isinstance(payload, dict) else None
+    if not isinstance(urls, list) or not urls or not all(isinstance(u, str) for u in urls):
+        return web.json_response({"error": "Request body must be JSON with a non-empty 'urls' list of strings."}, status=400)
+    if len(urls) > COMPARE_MAX_URLS:
+        return web.json_response({"error": f"Too many URLs; the limit is {COMPARE_MAX_URLS} per request."}, status=413)
+
+    urls = [u.strip() for u in urls]
+    tasks = [asyncio.ensure_future(_compare_one(url)) for url in urls]
+    await asyncio.wait(tasks, timeout=COMPARE_BATCH_TIMEOUT)
+    results = []
+    for url, task in zip(urls, tasks):
+        if task.done():
+            results.append(task.result())
+        else:
+            task.cancel()
+            results.append({"url": url, "status": "timeout", "error": "Timed out waiting for comparison."})
+    summary = {status: sum(1 for r in results if r["status"] == status) for status in ("ok", "error", "timeout")}
+    return web.json_response({"results": results, "summary": summary})
+
+async def wsgi_fallback(request):
+    """Serves any other route from the Flask app on a thread (watchlist, history, metrics...)."""
+    body = await request.read()
+    environ = EnvironBuilder(
+        path=request.path,
+        method=request.method,
+        query_string=request.query_string,
+        headers=[(k, v) for k, v in request.headers.items() if k.lower() != "content-length"],
+        data=body,
+        environ_overrides={"REMOTE_ADDR": request.remote or ""},
+    ).get_environ()
+
+    def call():
+        app_iter, status, headers = run_wsgi_app(flask_app.wsgi_app, environ, buffered=True)
+        try:
+            return status, headers, b"".join(app_iter)
+        finally:
+            getattr(app_iter, "close", lambda: None)()
+
+    status, headers, data = await asyncio.to_thread(call)
+    response = web.Response(status=int(status.split(" ", 1)[0]), body=data)
+    for name, value in headers.items():
+        if name.lower() not in ("content-length", "transfer-encoding"):
+            response.headers.add(name, value)
+    return response
+
+# --- App Factory ---
+
+async def http_metrics(request, handler):
+    """Middleware recording request metrics for the async routes; the Flask app records its own."""
+    resource = request.match_info.route.resource
+    endpoint = resource.name if resource else None
+    if endpoint is None:
+        return await handler(request)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        HTTP_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+        HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=status)
+
+async def _close_session(_):
+    await async_pipeline.close_session()
+
+async def create_app():
+    """The aiohttp application (also the gunicorn aiohttp.GunicornWebWorker entry point)."""
+    global _compare_slots
+    if web is None:
+        raise RuntimeError("The async server mode needs aiohttp (pip install aiohttp)")
+    _compare_slots = asyncio.Semaphore(ASYNC_COMPARE_CONCURRENCY)
+    application = web.Application(middlewares=[web.middleware(http_metrics)])
+    index_resource = application.router.add_resource("/", name="index")
+    index_resource.add_route("GET", index)
+    index_resource.add_route("POST", index)
+    application.router.add_get("/compare", compare_permalink, name="compare_permalink")
+    application.router.add_post("/api/compare", api_compare, name="api_compare")
+    application.router.add_static("/static", flask_app.static_folder)
+    application.router.add_route("*", "/{tail:.*}", wsgi_fallback)
+    application.on_cleanup.append(_close_session)
+    return application
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the price comparison app in async server mode.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port)
@@ -0,0 +1,259 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.utils import get_encoding_from_headers
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+import http_client
+import pipeline
+from circuit import UpstreamUnavailable
+from observability import timed_stage, classify_upstream_error, UPSTREAM_SECONDS, UPSTREAM_ERRORS
+from pipeline import (build_alternatives_result, build_product_details, cached_alternatives,
+                      make_product_key, parse_product_data, parse_tracker_response, product_cache, product_data_breaker,
+                      product_data_url, stage_result, tracker_cache, tracker_page_breaker)
+from singleflight import AsyncSingleFlight
+from tracker_cache import TrackerPageCache
+
+# --- Async Comparison Pipeline ---
+# The compare_product pipeline on asyncio for the async server mode (async_app.py):
+# upstream calls go through aiohttp, so one process can hold hundreds of comparisons
+# in flight. Caches, circuit breakers, history and result building are shared with
+# pipeline.py; only the I/O differs. Parsing runs on a thread pool so the event loop
+# never blocks on BeautifulSoup, and SQLite work (history, and the product and
+# tracker caches when they use the SQLite backend) runs on the default executor.
+
+logger = logging.getLogger(__name__)
+
+# --- Settings ---
+ASYNC_POOL_MAXSIZE = int(os.environ.get("ASYNC_POOL_MAXSIZE", 512))  # open upstream connections, all hosts
+ASYNC_POOL_PER_HOST = int(os.environ.get("ASYNC_POOL_PER_HOST", 256))
+ASYNC_PARSE_WORKERS = int(os.environ.get("ASYNC_PARSE_WORKERS", min(8, os.cpu_count() or 4)))
+
+parse_executor = ThreadPoolExecutor(max_workers=ASYNC_PARSE_WORKERS, thread_name_prefix="parse")
+
+# --- HTTP Client ---
+
+_session = None
+
+def get_session():
+    """Returns the shared aiohttp session, created on first use inside the running loop."""
+    global _session
+    if aiohttp is None:
+        raise RuntimeError("The async server mode needs aiohttp (pip install aiohttp)")
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=ASYNC_POOL_MAXSIZE, limit_per_host=ASYNC_POOL_PER_HOST, ttl_dns_cache=300)
+        _session = aiohttp.ClientSession(connector=connector, headers={
+            "User-Agent": http_client.USER_AGENT,
+            "Accept-Encoding": http_client.ACCEPT_ENCODING,
+        })
+    return _session
+
+async def close_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+class UpstreamResponse:
+    """
+    A fully read aiohttp response with the requests.Response attributes the shared
+    pipeline code uses (status_code, headers, content, encoding).
+    """
+    __slots__ = ("url", "status_code", "headers", "content", "encoding")
+
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        # Same rule as requests: the declared charset, ISO-8859-1 for undeclared text/*.
+        self.encoding = get_encoding_from_headers(headers)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+    def json(self):
+        return json.loads(self.content)
+
+async def request(method, url, timeout=None, retries=None, headers=None, deadline=None):
+    """
+    Async counterpart of http_client.request with the same retry policy and deadline.
+    aiohttp errors are re-raised as the matching requests exceptions, so circuit
+    breakers, error classes and the shared except clauses behave exactly as on the
+    sync path.
+    """
+    session = get_session()
+    method = method.upper()
+    timeout = timeout or (http_client.CONNECT_TIMEOUT, http_client.READ_TIMEOUT)
+    retries = http_client.MAX_RETRIES if retries is None else retries
+    if method not in http_client.IDEMPOTENT_METHODS:
+        retries = 0
+    deadline = time.monotonic() + (deadline if deadline is not None else timeout[0] + timeout[1])
+
+    attempt = 0
+    while True:
+        connect_timeout, read_timeout = http_client.attempt_timeout(timeout, deadline)
+        client_timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        try:
+            async with session.request(method, url, timeout=client_timeout, headers=headers) as response:
+                delay = None
+                if response.status in http_client.RETRY_STATUSES and attempt < retries:
+                    delay = http_client.retry_after(response)
+                    delay = delay if delay is not None else http_client.backoff_delay(attempt)
+                if delay is None or time.monotonic() + delay >= deadline:
+                    body = await response.read()
+                    return UpstreamResponse(str(response.url), response.status, response.headers, body)
+        except aiohttp.ConnectionTimeoutError as e:
+            delay = http_client.backoff_delay(attempt)
+            if attempt >= retries or time.monotonic() + delay >= deadline:
+                raise requests.exceptions.ConnectTimeout(f"Timed out connecting to {url}") from e
+        except asyncio.TimeoutError as e:  # Read timeouts are not retried, as in http_client.request
+            raise requests.exceptions.ReadTimeout(f"Timed out requesting {url}") from e
+        except aiohttp.ClientError as e:
+            delay = http_client.backoff_delay(attempt)
+            if attempt >= retries or time.monotonic() + delay >= deadline:
+                raise requests.exceptions.ConnectionError(f"{type(e).__name__}: {e}") from e
+        await asyncio.sleep(delay)
+        attempt += 1
+
+# --- Product Data ---
+
+product_data_flight = AsyncSingleFlight("product_data_async")
+tracker_page_flight = AsyncSingleFlight("tracker_page_async")
+pipeline.flight_groups += [product_data_flight, tracker_page_flight]
+
+async def fetch_price_from_buyhatke(product_id, site_type):
+    """Async pipeline.fetch_price_from_buyhatke: (product_name, price, tracker_url, thumbnails)."""
+    buyhatke_api_url = product_data_url(product_id, site_type)
+    if buyhatke_api_url is None:
+        logger.error("Unsupported site_type: %s", site_type)
+        return None, None, None, None
+
+    logger.info("Querying BuyHatke API site=%s pid=%s url=%s", site_type, product_id, buyhatke_api_url)
+    try:
+        with product_data_breaker.call() as timeout:
+            start = time.perf_counter()
+            try:
+                response = await request("GET", buyhatke_api_url, timeout=timeout)
+                response.raise_for_status()
+            finally:
+                UPSTREAM_SECONDS.observe(time.perf_counter() - start, endpoint="product_data")
+        return parse_product_data(response.json(), site_type, product_id)
+    except requests.exceptions.RequestException as e:
+        UPSTREAM_ERRORS.inc(endpoint="product_data", error_class=classify_upstream_error(e))
+        level = logging.WARNING if isinstance(e, UpstreamUnavailable) else logging.ERROR
+        logger.log(level, "Error fetching data from BuyHatke API site=%s pid=%s: %s", site_type, product_id, e)
+        return None, None, None, None
+    except ValueError as e: # JSON decode error
+        UPSTREAM_ERRORS.inc(endpoint="product_data", error_class=classify_upstream_error(e))
+        logger.error("Error decoding JSON response from BuyHatke API: %s raw=%.200r", e, response.content)
+        return None, None, None, None
+
+async def get_product_data(product_id, site_type):
+    """Async pipeline.get_product_data (through the same product cache)."""
+    key = make_product_key(site_type, product_id)
+    loader = lambda: product_data_flight.do(key, lambda: fetch_price_from_buyhatke(product_id, site_type))
+    result = await product_cache.get_or_load_async(key, loader)
+    if result[0] is None and result[1] is None and product_data_breaker.is_open():
+        # degraded_product_data, with the cache read off the event loop
+        return await product_cache.peek_async(key) or result
+    return result
+
+# --- Alternatives ---
+
+async def scrape_buyhatke_alternatives(tracker_url):
+    """Async pipeline.scrape_buyhatke_alternatives: a list of Offers, or None on error."""
+    if not tracker_url or not tracker_url.startswith("http"):
+        logger.info("Invalid or missing tracker URL provided. Cannot scrape alternatives.")
+        return None
+
+    alternatives = await tracker_page_flight.do(tracker_url, lambda: _download_alternatives(tracker_url))
+    if alternatives is None:
+        return None
+    return list(alternatives)
+
+async def _download_alternatives(tracker_url):
+    logger.info("Downloading BuyHatke page url=%s", tracker_url)
+    loop = asyncio.get_running_loop()
+    try:
+        cached_page = None
+        if tracker_cache and tracker_cache.pages.blocking:
+            cached_page = await asyncio.to_thread(tracker_cache.lookup, tracker_url)
+        elif tracker_cache:
+            cached_page = tracker_cache.lookup(tracker_url)
+        with timed_stage("html_download"), tracker_page_breaker.call() as timeout:
+            start = time.perf_counter()
+            try:
+                response = await request("GET", tracker_url, timeout=timeout,
+                                         headers=TrackerPageCache.conditional_headers(cached_page))
+                response.raise_for_status()
+            finally:
+                UPSTREAM_SECONDS.observe(time.perf_counter() - start, endpoint="tracker_page")
+        logger.debug("HTML downloaded status=%s bytes=%d", response.status_code, len(response.content))
+        return await loop.run_in_executor(parse_executor, parse_tracker_response, tracker_url, cached_page, response)
+    except requests.exceptions.RequestException as e:
+        UPSTREAM_ERRORS.inc(endpoint="tracker_page", error_class=classify_upstream_error(e))
+        level = logging.WARNING if isinstance(e, UpstreamUnavailable) else logging.ERROR
+        logger.log(level, "Error downloading BuyHatke page HTML url=%s: %s", tracker_url, e)
+        return None
+    except Exception:
+        logger.exception("Unexpected error during scraping url=%s", tracker_url)
+        return None
+
+async def fetch_alternatives(product_info, tracker_url, input_url, site_type):
+    """Async pipeline.fetch_alternatives: (result, upstream_failed)."""
+    alternatives = await scrape_buyhatke_alternatives(tracker_url) if tracker_url else None
+    degraded = bool(tracker_url) and alternatives is None and tracker_page_breaker.is_open()
+    cached = None
+    if degraded:
+        cached = await asyncio.get_running_loop().run_in_executor(parse_executor, cached_alternatives, tracker_url)
+    return build_alternatives_result(product_info, tracker_url, input_url, site_type, alternatives, degraded, cached)
+
+# --- Comparison ---
+
+async def compare_product_stages(input_url, note_request=True):
+    """Async generator form of pipeline.compare_product_stages, with the same stages."""
+    logger.info("Processing URL: %s", input_url)
+
+    # Short links are resolved with a blocking HEAD request (cached per link).
+    site_type, product_id, original_domain, error = await asyncio.to_thread(pipeline.detect_product, input_url)
+    if error:
+        yield "complete", stage_result(error=error)
+        return
+
+    if note_request:
+        product_key = pipeline.note_product_request(site_type, product_id)
+    else:
+        product_key = make_product_key(site_type, product_id)
+    snapshot = await asyncio.to_thread(pipeline.lookup_snapshot, product_key)
+    if snapshot:
+        result = pipeline.snapshot_result(snapshot, input_url, original_domain, None)
+    else:
+        with timed_stage("api_fetch"):
+            api_result = await get_product_data(product_id, site_type)
+        product_info, tracker_url, error = build_product_details(input_url, site_type, product_id, original_domain,
+                                                                 api_result)
+        if error:
+            result, upstream_failed = pipeline.failed_result(error, product_info), True
+        else:
+            yield "product", stage_result(product_info=product_info)
+            result, upstream_failed = await fetch_alternatives(product_info, tracker_url, input_url, site_type)
+        result = await asyncio.to_thread(pipeline.settle_live_result, product_key, result, upstream_failed,
+                                         input_url, original_domain)
+    yield "complete", await asyncio.to_thread(pipeline.attach_price_history, product_key, result)
+
+async def compare_product(input_url, note_request=True):
+    """Async pipeline.compare_product."""
+    async for _, result in compare_product_stages(input_url, note_request):
+        pass
+    return result
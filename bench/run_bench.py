@@ -0,0 +1,341 @@
+"""
+Offline benchmark for app.py.
+
+Starts the local BuyHatke stand-in (bench/stub_server.py), points the app at it,
+and drives index() (form POST, following its redirect to the /compare permalink)
+and /api/compare at a fixed concurrency. Reports throughput, p50/p95/p99 latency,
+time to first byte and per-stage timings, and writes them as JSON.
+
+--server picks what is driven:
+  inprocess  the Flask test client, no sockets (default)
+  sync       app.py over HTTP on a fixed pool of --sync-workers threads, each
+             serving one request at a time like gunicorn sync workers
+  async      async_app.py over HTTP on one event loop (needs aiohttp)
+
+Examples:
+    python bench/run_bench.py --requests 400 --concurrency 16 --latency-ms 50 --output bench_output.json
+    python bench/run_bench.py --baseline old.json --max-regression 0.10   # exit 1 on regression
+    python bench/run_bench.py --server sync --sync-workers 16 --concurrency 200 --latency-ms 200 --output sync.json
+    python bench/run_bench.py --server async --concurrency 200 --latency-ms 200 --baseline sync.json
+"""
+import argparse
+import asyncio
+import atexit
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from stub_server import start_stub_server  # noqa: E402
+
+STAGES = ("pid_extraction", "api_fetch", "html_download", "parse", "lowest_price_scan")
+SCENARIOS = ("form", "api")
+SERVERS = ("inprocess", "sync", "async")
+
+# --- Helpers ---
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+def summarize_ms(seconds):
+    values = sorted(s * 1000.0 for s in seconds)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values), 3),
+        "p50_ms": round(percentile(values, 50), 3),
+        "p95_ms": round(percentile(values, 95), 3),
+        "p99_ms": round(percentile(values, 99), 3),
+        "max_ms": round(values[-1], 3),
+    }
+
+class StageRecorder:
+    """Collects per-stage durations from every thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {stage: [] for stage in STAGES}
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def reset(self):
+        with self.lock:
+            self.samples = {stage: [] for stage in STAGES}
+
+    def summary(self):
+        with self.lock:
+            return {stage: summarize_ms(values) for stage, values in self.samples.items()}
+
+# --- Servers ---
+
+class InProcessClient:
+    """Calls the Flask app directly through its test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def post(self, path, **kwargs):
+        """Returns (status_code, body chunk iterator, close)."""
+        response = self.client.post(path, buffered=False, follow_redirects=True, **kwargs)
+        return response.status_code, response.response, response.close
+
+class HTTPClient:
+    """Calls a server over HTTP with one keep-alive session per client thread."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.session = requests.Session()
+
+    def post(self, path, **kwargs):
+        response = self.session.post(self.base_url + path, stream=True, **kwargs)
+        return response.status_code, response.iter_content(chunk_size=None), response.close
+
+class _OneRequestPerConnection(WSGIRequestHandler):
+    protocol_version = "HTTP/1.0"  # gunicorn sync workers do not keep connections alive
+
+    def log_request(self, *args):
+        pass
+
+class PooledWSGIServer(BaseWSGIServer):
+    """WSGI server handling connections on a fixed thread pool, one request per thread at a time."""
+    multithread = True
+    request_queue_size = 1024  # Connections beyond the workers wait in the listen backlog
+
+    def __init__(self, host, port, app, workers):
+        super().__init__(host, port, app, handler=_OneRequestPerConnection)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sync-worker")
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+def start_sync_server(app, workers):
+    """Serves the Flask app in the background; returns its base URL."""
+    server = PooledWSGIServer("127.0.0.1", 0, app, workers)
+    threading.Thread(target=server.serve_forever, name="sync-server", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+def start_async_server():
+    """Serves async_app on an event loop in a background thread; returns its base URL."""
+    import async_app
+    from aiohttp import web
+
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(loop.run_until_complete(async_app.create_app()), access_log=None)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", 0, backlog=1024).start())
+    threading.Thread(target=loop.run_forever, name="async-server", daemon=True).start()
+    atexit.register(lambda: asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result(10))
+    return f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+# --- Load Generation ---
+
+def run_scenario(make_client, scenario, product_urls, total_requests, concurrency, batch_size):
+    """Sends total_requests requests from `concurrency` threads. Returns a result dict."""
+    latencies = []
+    first_byte = []
+    statuses = {}
+    errors = 0
+    lock = threading.Lock()
+    next_index = [0]
+
+    def worker():
+        nonlocal errors
+        client = make_client()
+        while True:
+            with lock:
+                i = next_index[0]
+                if i >= total_requests:
+                    return
+                next_index[0] += 1
+            start = time.perf_counter()
+            try:
+                if scenario == "form":
+                    url = product_urls[i % len(product_urls)]
+                    status, chunks, close = client.post("/", data={"product_url": url})
+                else:
+                    batch = [product_urls[(i * batch_size + j) % len(product_urls)] for j in range(batch_size)]
+                    status, chunks, close = client.post("/api/compare", json={"urls": batch})
+                # Read the body here so streamed pages are timed to the last chunk.
+                ttfb = None
+                try:
+                    for chunk in chunks:
+                        if ttfb is None and chunk:
+                            ttfb = time.perf_counter() - start
+                finally:
+                    close()
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+                    first_byte.append(ttfb if ttfb is not None else elapsed)
+                    statuses[status] = statuses.get(status, 0) + 1
+            except Exception:
+                with lock:
+                    errors += 1
+
+    threads = [threading.Thread(target=worker, name=f"bench-{n}") for n in range(concurrency)]
+    wall_start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - wall_start
+
+    completed = len(latencies)
+    items_per_request = 1 if scenario == "form" else batch_size
+    return {
+        "requests": completed,
+        "client_errors": errors,
+        "status_codes": {str(k): v for k, v in sorted(statuses.items())},
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(completed / wall, 3) if wall else None,
+        "throughput_products_per_s": round(completed * items_per_request / wall, 3) if wall else None,
+        "latency": summarize_ms(latencies),
+        "first_byte": summarize_ms(first_byte),
+    }
+
+# --- Regression Check ---
+
+def compare_to_baseline(current, baseline, max_regression):
+    """Returns a list of human-readable regressions beyond max_regression (a fraction)."""
+    regressions = []
+    for name, result in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            old, new = base["latency"].get(key), result["latency"].get(key)
+            if old and new and new > old * (1 + max_regression):
+                regressions.append(f"{name} {key}: {old:.1f} -> {new:.1f}")
+        old, new = base.get("throughput_rps"), result.get("throughput_rps")
+        if old and new and new < old * (1 - max_regression):
+            regressions.append(f"{name} throughput_rps: {old:.1f} -> {new:.1f}")
+    return regressions
+
+# --- Main ---
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated: form,api")
+    parser.add_argument("--server", choices=SERVERS, default="inprocess", help="what to drive (see above)")
+    parser.add_argument("--sync-workers", type=int, default=8, help="request threads for --server sync")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=10, help="URLs per /api/compare request")
+    parser.add_argument("--products", type=int, default=50, help="distinct products to cycle through")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="stand-in upstream latency")
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls answered 503")
+    parser.add_argument("--cache", action="store_true",
+                        help="leave the product, tracker page and rendered page caches and snapshot serving enabled")
+    parser.add_argument("--warmup", type=int, default=10, help="unrecorded requests before each scenario")
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--baseline", help="previous results JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.10)
+    parser.add_argument("--verbose", action="store_true", help="keep the app's INFO logging")
+    args = parser.parse_args()
+
+    _, stub, base_url = start_stub_server(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                          error_rate=args.error_rate)
+    os.environ["BUYHATKE_BASE_URL"] = base_url
+    if not args.verbose:
+        os.environ["LOG_LEVEL"] = "WARNING"
+    state_dir = tempfile.mkdtemp(prefix="bench-")
+    os.environ["PRICE_HISTORY_PATH"] = os.path.join(state_dir, "price_history.sqlite3")
+    os.environ["WATCHLIST_PATH"] = os.path.join(state_dir, "watchlist.sqlite3")
+    if not args.cache:
+        os.environ["PRODUCT_CACHE_TTL"] = "0"
+        os.environ["PRODUCT_CACHE_STALE_TTL"] = "0"
+        os.environ["PRICE_HISTORY_SNAPSHOT_MAX_AGE"] = "0"
+        os.environ["TRACKER_CACHE_ENABLED"] = "0"
+        os.environ["PAGE_CACHE_TTL"] = "0"
+        os.environ["PAGE_CACHE_STALE_TTL"] = "0"
+    # Measure the servers, not the circuit breakers' load shedding.
+    os.environ.setdefault("UPSTREAM_MAX_IN_FLIGHT", str(max(512, args.concurrency * args.batch_size)))
+
+    import app as app_module  # Imported after the environment is configured.
+    import tracker_parser
+    from observability import add_stage_listener
+
+    recorder = StageRecorder()
+    add_stage_listener(recorder.add)
+    if args.server == "inprocess":
+        make_client = lambda: InProcessClient(app_module.app)
+    else:
+        base = start_sync_server(app_module.app, args.sync_workers) if args.server == "sync" else start_async_server()
+        make_client = lambda: HTTPClient(base)
+    product_urls = [f"https://www.amazon.in/dp/B0BEN{n:05d}" for n in range(args.products)]
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "parser": tracker_parser.FAST_PARSER,
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        },
+        "scenarios": {},
+    }
+
+    for scenario in [s.strip() for s in args.scenarios.split(",") if s.strip()]:
+        if scenario not in SCENARIOS:
+            parser.error(f"unknown scenario {scenario!r}")
+        if args.warmup:
+            run_scenario(make_client, scenario, product_urls, args.warmup, min(args.concurrency, args.warmup), args.batch_size)
+        recorder.reset()
+        result = run_scenario(make_client, scenario, product_urls, args.requests, args.concurrency, args.batch_size)
+        result["stages"] = recorder.summary()
+        results["scenarios"][scenario] = result
+        lat = result["latency"]
+        print(f"{scenario:>5}: {result['throughput_rps']} req/s, p50 {lat.get('p50_ms')} ms, "
+              f"p95 {lat.get('p95_ms')} ms, p99 {lat.get('p99_ms')} ms, "
+              f"first byte p50 {result['first_byte'].get('p50_ms')} ms, status {result['status_codes']}")
+        for stage, summary in result["stages"].items():
+            if summary["count"]:
+                print(f"        {stage:<18} n={summary['count']:<6} p50 {summary['p50_ms']} ms  p95 {summary['p95_ms']} ms")
+
+    results["upstream_requests"] = dict(stub.request_counts)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.max_regression)
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("No regressions against baseline.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
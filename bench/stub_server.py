@@ -0,0 +1,109 @@
+"""
+Local stand-in for buyhatke.com used by the benchmark.
+
+Serves /api/productData from fixtures/product_data.json (with the requested pid
+mixed into the name and internalPid so every product gets its own tracker page)
+and every other path from fixtures/tracker_page.html, with an ETag so conditional
+GETs are answered with 304 Not Modified. Latency and error rate
+are configurable so runs can model a slow or flaky upstream.
+
+Run standalone: python bench/stub_server.py --port 8765 --latency-ms 80
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+
+
+class StubConfig:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, fixtures_dir=FIXTURES_DIR):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.product_template = json.loads((Path(fixtures_dir) / "product_data.json").read_text(encoding="utf-8"))
+        self.tracker_page = (Path(fixtures_dir) / "tracker_page.html").read_bytes()
+        self.tracker_etag = f'"{zlib.crc32(self.tracker_page):08x}"'
+        self.request_counts = {"api": 0, "tracker": 0, "not_modified": 0, "errors": 0}
+        self.lock = threading.Lock()
+
+    def count(self, kind):
+        with self.lock:
+            self.request_counts[kind] += 1
+
+
+def _make_handler(config):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real upstream
+
+        def do_GET(self):
+            delay = config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)
+            if delay > 0:
+                time.sleep(delay / 1000.0)
+            if config.error_rate and random.random() < config.error_rate:
+                config.count("errors")
+                self._send(503, b"upstream unavailable", "text/plain")
+                return
+
+            parsed = urlparse(self.path)
+            if parsed.path == "/api/productData":
+                config.count("api")
+                pid = parse_qs(parsed.query).get("pid", ["UNKNOWN"])[0]
+                payload = json.loads(json.dumps(config.product_template))
+                payload["data"]["name"] = f"{payload['data']['name']} {pid}"
+                payload["data"]["internalPid"] = zlib.crc32(pid.encode()) % 10**8
+                self._send(200, json.dumps(payload).encode("utf-8"), "application/json")
+            else:
+                config.count("tracker")
+                if self.headers.get("If-None-Match") == config.tracker_etag:
+                    config.count("not_modified")
+                    self._send(304, b"", "text/html; charset=utf-8", etag=config.tracker_etag)
+                else:
+                    self._send(200, config.tracker_page, "text/html; charset=utf-8", etag=config.tracker_etag)
+
+        def _send(self, status, body, content_type, etag=None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            if etag:
+                self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+def start_stub_server(host="127.0.0.1", port=0, **config_kwargs):
+    """Starts the stand-in on a daemon thread. Returns (server, config, base_url)."""
+    config = StubConfig(**config_kwargs)
+    server = ThreadingHTTPServer((host, port), _make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="buyhatke-stub", daemon=True).start()
+    return server, config, f"http://{host}:{server.server_port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local BuyHatke stand-in.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server, _, base_url = start_stub_server(args.host, args.port, latency_ms=args.latency_ms,
+                                            jitter_ms=args.jitter_ms, error_rate=args.error_rate)
+    print(f"BuyHatke stand-in listening on {base_url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,310 @@
+import asyncio
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Settings ---
+REFRESH_WORKERS = int(os.environ.get("CACHE_REFRESH_WORKERS", 4))  # threads refreshing stale entries, all caches
+REFRESH_QUEUE_MAX = int(os.environ.get("CACHE_REFRESH_QUEUE_MAX", 64))  # waiting refreshes beyond this are dropped
+
+# Stale entries read on the sync paths are refreshed on one small pool shared by
+# every TTLCache. A refresh that finds the queue full is dropped; the entry keeps
+# being served stale and a later hit (or the synchronous load once it expires)
+# refreshes it.
+refresh_executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix="cache-refresh")
+_refresh_slots = threading.BoundedSemaphore(REFRESH_WORKERS + REFRESH_QUEUE_MAX)
+
+# --- Cache Backends ---
+# A backend stores (value, stored_at) pairs under string keys and is responsible
+# for LRU eviction. TTL / stale-while-revalidate policy lives in TTLCache so any
+# backend gets it for free. `blocking` backends do I/O, so the async paths call
+# them on a thread instead of on the event loop.
+
+class MemoryBackend:
+    """In-process LRU store bounded by entry count and (approximate) memory size."""
+
+    blocking = False
+
+    def __init__(self, max_entries=1024, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()  # key -> (value, stored_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            self._data.move_to_end(key)
+            return entry[0], entry[1]
+
+    def set(self, key, value, stored_at):
+        size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = (value, stored_at, size)
+            self._bytes += size
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= evicted[2]
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def size(self):
+        with self._lock:
+            return len(self._data), self._bytes
+
+
+class SQLiteBackend:
+    """
+    LRU store in a SQLite file, so every gunicorn worker on the host shares one cache.
+    Values are pickled; eviction trims least-recently-accessed rows.
+    """
+
+    blocking = True
+
+    def __init__(self, path, max_entries=10000, max_bytes=128 * 1024 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self.evictions = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, stored_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache (accessed_at)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute("SELECT value, stored_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return pickle.loads(row[0]), row[1]
+
+    def set(self, key, value, stored_at):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, stored_at, accessed_at, size) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, stored_at, time.time(), len(blob)),
+            )
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+            while count > self.max_entries or total > self.max_bytes:
+                row = conn.execute("SELECT key, size FROM cache ORDER BY accessed_at LIMIT 1").fetchone()
+                if row is None:
+                    break
+                conn.execute("DELETE FROM cache WHERE key = ?", (row[0],))
+                count -= 1
+                total -= row[1]
+                self.evictions += 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        self._conn().execute("DELETE FROM cache")
+
+    def size(self):
+        return tuple(self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone())
+
+
+# --- TTL Cache with Stale-While-Revalidate ---
+
+_MISSING = object()
+
+class TTLCache:
+    """
+    Wraps a backend with a freshness policy:
+      - age < ttl: served as a hit.
+      - ttl <= age < ttl + stale_ttl: served immediately, refreshed on refresh_executor.
+      - older (or missing): loaded synchronously.
+    Loader results for which `cacheable(result)` is false are returned but not stored.
+    """
+
+    def __init__(self, backend, ttl=600, stale_ttl=3600, cacheable=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.cacheable = cacheable or (lambda value: value is not None)
+        self._refreshing = set()
+        self._refresh_tasks = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.refresh_drops = 0
+
+    def get_or_load(self, key, loader):
+        value = self._lookup(key, lambda: self._refresh_in_background(key, loader))
+        return self._load(key, loader) if value is _MISSING else value
+
+    async def get_or_load_async(self, key, loader):
+        """
+        get_or_load for a coroutine function `loader`, used by the async pipeline.
+        Stale entries are refreshed by a task on the running event loop.
+        """
+        entry = await self._call_backend(self.backend.get, key)
+        value = self._check(entry, lambda: self._refresh_in_task(key, loader))
+        return await self._load_async(key, loader) if value is _MISSING else value
+
+    def get(self, key, loader, in_task=False):
+        """
+        get_or_load without the load on a miss: returns None instead, for callers that
+        produce the value themselves and store it with set(). Stale entries are still
+        refreshed with `loader`, by a task on the running loop if in_task is set.
+        """
+        refresh = self._refresh_in_task if in_task else self._refresh_in_background
+        value = self._lookup(key, lambda: refresh(key, loader))
+        return None if value is _MISSING else value
+
+    def peek(self, key):
+        """Returns the stored value regardless of age, or None."""
+        entry = self.backend.get(key)
+        return entry[0] if entry is not None else None
+
+    async def peek_async(self, key):
+        """peek without blocking the event loop on the backend."""
+        entry = await self._call_backend(self.backend.get, key)
+        return entry[0] if entry is not None else None
+
+    def set(self, key, value):
+        self.backend.set(key, value, time.time())
+
+    def refresh(self, key, loader):
+        """Loads synchronously and stores the result (if cacheable), ignoring any cached value."""
+        return self._load(key, loader)
+
+    def invalidate(self, key):
+        self.backend.delete(key)
+
+    def _lookup(self, key, refresh):
+        """The stored value, calling refresh() if it is stale, or _MISSING (counted as a miss)."""
+        return self._check(self.backend.get(key), refresh)
+
+    def _check(self, entry, refresh):
+        if entry is not None:
+            value, stored_at = entry
+            age = time.time() - stored_at
+            if age < self.ttl:
+                self.hits += 1
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                refresh()
+                return value
+        self.misses += 1
+        return _MISSING
+
+    def _load(self, key, loader):
+        value = loader()
+        if self.cacheable(value):
+            self.backend.set(key, value, time.time())
+        return value
+
+    def _refresh_in_background(self, key, loader):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            if not _refresh_slots.acquire(blocking=False):
+                self.refresh_drops += 1
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                self._load(key, loader)
+                self.refreshes += 1
+            except Exception:
+                self.refresh_errors += 1
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+                _refresh_slots.release()
+
+        refresh_executor.submit(run)
+
+    async def _load_async(self, key, loader):
+        value = await loader()
+        if self.cacheable(value):
+            await self._call_backend(self.backend.set, key, value, time.time())
+        return value
+
+    async def _call_backend(self, method, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    def _refresh_in_task(self, key, loader):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        async def run():
+            try:
+                await self._load_async(key, loader)
+                self.refreshes += 1
+            except Exception:
+                self.refresh_errors += 1
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        task = asyncio.ensure_future(run())
+        self._refresh_tasks.add(task)  # The loop only keeps weak references to tasks
+        task.add_done_callback(self._refresh_tasks.discard)
+
+    def stats(self):
+        entries, size_bytes = self.backend.size()
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.backend.evictions,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "refresh_drops": self.refresh_drops,
+            "entries": entries,
+            "bytes": size_bytes,
+        }
@@ -0,0 +1,210 @@
+import collections
+import contextlib
+import logging
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# --- Circuit Breaker ---
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class UpstreamUnavailable(requests.exceptions.RequestException):
+    """Raised instead of calling an upstream the breaker has given up on (or is shedding)."""
+
+    def __init__(self, endpoint, error_class):
+        super().__init__(f"{endpoint}: {error_class.replace('_', ' ')}")
+        self.endpoint = endpoint
+        self.error_class = error_class  # "circuit_open" or "shed"
+
+
+def is_upstream_failure(exc):
+    """Timeouts, connection errors and 5xx responses count against a breaker; 4xx and decode errors do not."""
+    if isinstance(exc, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return True
+    if isinstance(exc, requests.exceptions.HTTPError):
+        status = getattr(exc.response, "status_code", None)
+        return status is None or status >= 500
+    return False
+
+
+class CircuitBreaker:
+    """
+    Per-endpoint breaker with an adaptive read timeout and an in-flight limit.
+
+    - closed: calls pass; `failure_threshold` consecutive failures open the circuit.
+    - open: calls fail fast with UpstreamUnavailable for `reset_timeout` seconds.
+    - half_open: up to `half_open_calls` probes pass; a success closes the circuit,
+      a failure opens it again.
+
+    The read timeout is `timeout_multiplier` x the p99 of recent successful calls,
+    clamped to [min_timeout, max_timeout] (max_timeout until `min_samples` are seen).
+    A timed-out call doubles it (up to max_timeout) and joins the latency window, so
+    an upstream that slowed down is not cut off for good. Opening the circuit clears
+    the window, and half-open probes get max_timeout. The timeout is the budget for
+    the whole guarded call: http_client fits its retries inside connect + read.
+    Calls beyond `max_in_flight` concurrent ones are shed rather than queued.
+    """
+
+    def __init__(self, endpoint, failure_threshold=5, reset_timeout=30.0, half_open_calls=1, max_in_flight=32,
+                 connect_timeout=3.05, min_timeout=1.0, max_timeout=15.0, timeout_multiplier=3.0,
+                 window=200, min_samples=20):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.max_in_flight = max_in_flight
+        self.connect_timeout = connect_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.min_samples = min_samples
+        self._latencies = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.in_flight = 0
+        self._probes = 0
+        self.read_timeout = max_timeout
+        self.counts = {"success": 0, "failure": 0, "circuit_open": 0, "shed": 0, "opened": 0}
+
+    @contextlib.contextmanager
+    def call(self):
+        """
+        Guards one upstream call: yields the (connect, read) timeout to use, raises
+        UpstreamUnavailable when the call is not allowed, and records the outcome.
+        """
+        probe = self._enter()
+        start = time.monotonic()
+        try:
+            yield (self.connect_timeout, self.max_timeout if probe else self.read_timeout)
+        except BaseException as e:
+            timed_out = isinstance(e, requests.exceptions.Timeout)
+            self._exit(failed=is_upstream_failure(e), latency=time.monotonic() - start if timed_out else None)
+            raise
+        self._exit(failed=False, latency=time.monotonic() - start)
+
+    def _enter(self):
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probes = 0
+                logger.info("Circuit %s half-open; probing upstream", self.endpoint)
+            if self.state == OPEN or (self.state == HALF_OPEN and self._probes >= self.half_open_calls):
+                self.counts["circuit_open"] += 1
+                raise UpstreamUnavailable(self.endpoint, "circuit_open")
+            if self.in_flight >= self.max_in_flight:
+                self.counts["shed"] += 1
+                raise UpstreamUnavailable(self.endpoint, "shed")
+            probe = self.state == HALF_OPEN
+            if probe:
+                self._probes += 1
+            self.in_flight += 1
+            return probe
+
+    def _exit(self, failed, latency):
+        with self._lock:
+            self.in_flight -= 1
+            if failed:
+                self.counts["failure"] += 1
+                self.consecutive_failures += 1
+                if latency is not None:  # A timeout: the upstream needs longer than we gave it
+                    self._latencies.append(latency)
+                    self.read_timeout = min(self.max_timeout, self.read_timeout * 2)
+                if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                    self._open()
+                return
+            self.counts["success"] += 1
+            self.consecutive_failures = 0
+            if self.state == HALF_OPEN:
+                self.state = CLOSED
+                logger.info("Circuit %s closed", self.endpoint)
+            if latency is not None:
+                self._latencies.append(latency)
+                if len(self._latencies) % 10 == 0 or len(self._latencies) == self.min_samples:
+                    self.read_timeout = self._adaptive_timeout()
+
+    def _open(self):
+        if self.state != OPEN:
+            self.counts["opened"] += 1
+            logger.warning("Circuit %s open after %d consecutive failures; failing fast for %ss",
+                           self.endpoint, self.consecutive_failures, self.reset_timeout)
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        # Latencies from before the outage say nothing about the upstream that comes back.
+        self._latencies.clear()
+        self.read_timeout = self.max_timeout
+
+    def _adaptive_timeout(self):
+        if len(self._latencies) < self.min_samples:
+            return self.max_timeout
+        p99 = self.percentile(99)
+        return min(self.max_timeout, max(self.min_timeout, p99 * self.timeout_multiplier))
+
+    def percentile(self, pct):
+        """Nearest-rank percentile of recent call latencies (successes and timeouts, seconds), or None."""
+        values = sorted(self._latencies)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+    def is_open(self):
+        """True while calls are being rejected (open, or half-open with its probes in flight)."""
+        with self._lock:
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at < self.reset_timeout
+            return self.state == HALF_OPEN and self._probes >= self.half_open_calls
+
+    def snapshot(self):
+        with self._lock:
+            p50, p99 = self.percentile(50), self.percentile(99)
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "in_flight": self.in_flight,
+                "read_timeout": round(self.read_timeout, 3),
+                "latency_p50": round(p50, 4) if p50 is not None else None,
+                "latency_p99": round(p99, 4) if p99 is not None else None,
+                "open_for": round(time.monotonic() - self.opened_at, 1) if self.state == OPEN else None,
+                **self.counts,
+            }
+
+
+def metric_lines(*breakers):
+    """Prometheus exposition lines for one or more breakers."""
+    snapshots = [(b.endpoint, b.snapshot()) for b in breakers]
+    states = (CLOSED, HALF_OPEN, OPEN)
+    lines = [
+        "# HELP pricecompare_circuit_state Upstream circuit breaker state (1 for the current state).",
+        "# TYPE pricecompare_circuit_state gauge",
+    ]
+    for endpoint, snap in snapshots:
+        lines += [f'pricecompare_circuit_state{{endpoint="{endpoint}",state="{state}"}} {int(snap["state"] == state)}'
+                  for state in states]
+    lines += [
+        "# HELP pricecompare_circuit_rejected_total Upstream calls rejected without being sent.",
+        "# TYPE pricecompare_circuit_rejected_total counter",
+    ]
+    for endpoint, snap in snapshots:
+        lines += [f'pricecompare_circuit_rejected_total{{endpoint="{endpoint}",reason="{reason}"}} {snap[reason]}'
+                  for reason in ("circuit_open", "shed")]
+    lines += [
+        "# HELP pricecompare_circuit_read_timeout_seconds Current adaptive read timeout.",
+        "# TYPE pricecompare_circuit_read_timeout_seconds gauge",
+    ]
+    lines += [f'pricecompare_circuit_read_timeout_seconds{{endpoint="{endpoint}"}} {snap["read_timeout"]}'
+              for endpoint, snap in snapshots]
+    lines += [
+        "# HELP pricecompare_circuit_in_flight Upstream calls currently in flight.",
+        "# TYPE pricecompare_circuit_in_flight gauge",
+    ]
+    lines += [f'pricecompare_circuit_in_flight{{endpoint="{endpoint}"}} {snap["in_flight"]}'
+              for endpoint, snap in snapshots]
+    return lines
@@ -0,0 +1,124 @@
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- Constants ---
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", 3.05))
+READ_TIMEOUT = float(os.environ.get("UPSTREAM_READ_TIMEOUT", 15))
+POOL_CONNECTIONS = int(os.environ.get("UPSTREAM_POOL_CONNECTIONS", 4))  # distinct hosts kept in the pool
+POOL_MAXSIZE = int(os.environ.get("UPSTREAM_POOL_MAXSIZE", 32))  # keep-alive connections per host
+MAX_RETRIES = int(os.environ.get("UPSTREAM_MAX_RETRIES", 2))  # connection errors and retryable statuses, within one call's deadline
+BACKOFF_BASE = float(os.environ.get("UPSTREAM_BACKOFF_BASE", 0.25))  # seconds
+BACKOFF_MAX = float(os.environ.get("UPSTREAM_BACKOFF_MAX", 4.0))
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+# urllib3 decodes brotli transparently only when a brotli package is installed.
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        ACCEPT_ENCODING = "gzip, deflate, br"
+    except ImportError:
+        ACCEPT_ENCODING = "gzip, deflate"
+
+# --- Session Management ---
+# One Session per worker process. The pid check makes sure a forked gunicorn
+# worker never reuses sockets inherited from the master.
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+def _build_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "User-Agent": USER_AGENT,
+        "Accept-Encoding": ACCEPT_ENCODING,
+        "Connection": "keep-alive",
+    })
+    return session
+
+def get_session():
+    """Returns the shared keep-alive Session for this worker process."""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+# --- Requests with Retries ---
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff: uniform(0, min(max, base * 2**attempt))."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+def retry_after(response):
+    value = response.headers.get("Retry-After")
+    if value and value.isdigit():
+        return min(float(value), BACKOFF_MAX)
+    return None
+
+def attempt_timeout(timeout, deadline):
+    """The (connect, read) timeout for the next attempt, capped by the seconds left before deadline."""
+    remaining = max(0.001, deadline - time.monotonic())
+    return min(timeout[0], remaining), min(timeout[1], remaining)
+
+def request(method, url, timeout=None, retries=None, deadline=None, **kwargs):
+    """
+    Sends a request through the pooled session.
+    Idempotent methods are retried on connection errors (connect timeouts included) and
+    retryable statuses, with jittered exponential backoff. A read timeout is not retried:
+    the upstream already had the full read timeout to answer.
+    All attempts and backoff share one budget of `deadline` seconds (default: one
+    attempt's connect + read timeout), so retries never stretch a call beyond it.
+    The final response is returned as-is so callers can still use raise_for_status();
+    the final exception is re-raised.
+    """
+    method = method.upper()
+    timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+    retries = MAX_RETRIES if retries is None else retries
+    if method not in IDEMPOTENT_METHODS:
+        retries = 0
+    deadline = time.monotonic() + (deadline if deadline is not None else timeout[0] + timeout[1])
+
+    session = get_session()
+    attempt = 0
+    while True:
+        try:
+            response = session.request(method, url, timeout=attempt_timeout(timeout, deadline), **kwargs)
+        except requests.exceptions.ConnectionError:  # ConnectTimeout is a ConnectionError too
+            delay = backoff_delay(attempt)
+            if attempt >= retries or time.monotonic() + delay >= deadline:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+
+        if response.status_code in RETRY_STATUSES and attempt < retries:
+            delay = retry_after(response)
+            delay = delay if delay is not None else backoff_delay(attempt)
+            if time.monotonic() + delay < deadline:
+                response.close()
+                time.sleep(delay)
+                attempt += 1
+                continue
+        return response
+
+def get(url, **kwargs):
+    """GET through the pooled session with retries. See request()."""
+    return request("GET", url, **kwargs)
@@ -0,0 +1,232 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from flask import g, has_request_context, request
+
+# --- Logging ---
+# LOG_LEVEL=WARNING keeps the hot path almost free of logging work: every call site
+# uses lazy %-style arguments, so disabled records are never formatted.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")  # "text" or "json"
+
+_RESERVED_RECORD_KEYS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; fields passed via `extra=` become top-level keys."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_RECORD_KEYS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    """Installs a single stderr handler on the root logger (idempotent)."""
+    root = logging.getLogger()
+    if getattr(root, "_pricecompare_configured", False):
+        return
+    handler = logging.StreamHandler()
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root.addHandler(handler)
+    root.setLevel(level)
+    root._pricecompare_configured = True
+
+# --- Metrics ---
+# Minimal Prometheus text-format metrics so no client library is needed. Values are
+# per worker process; scrape each worker or run a single worker behind /metrics.
+
+_registry = []
+_collectors = []
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in pairs) + "}"
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+class Histogram:
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 30.0)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in items:
+            for i, bound in enumerate(self.buckets):
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bound)])} {state[i]}"
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {state[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {state[-2]}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}"
+
+def register_collector(func):
+    """Registers a callable returning extra exposition lines, evaluated on every scrape."""
+    _collectors.append(func)
+    return func
+
+def render_metrics():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.collect())
+    for collector in _collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
+
+def cache_metric_lines(caches):
+    """Exposition lines for a {cache_name: TTLCache.stats()} dict."""
+    lines = [
+        "# HELP pricecompare_cache_events_total Cache lookups by result.",
+        "# TYPE pricecompare_cache_events_total counter",
+    ]
+    for name, stats in caches.items():
+        for result, key in (("hit", "hits"), ("stale", "stale_hits"), ("miss", "misses")):
+            lines.append(f'pricecompare_cache_events_total{{cache="{name}",result="{result}"}} {stats[key]}')
+    lines += [
+        "# HELP pricecompare_cache_evictions_total Entries evicted by the LRU bound.",
+        "# TYPE pricecompare_cache_evictions_total counter",
+    ]
+    lines += [f'pricecompare_cache_evictions_total{{cache="{name}"}} {stats["evictions"]}' for name, stats in caches.items()]
+    lines += [
+        "# HELP pricecompare_cache_entries Entries currently stored.",
+        "# TYPE pricecompare_cache_entries gauge",
+    ]
+    lines += [f'pricecompare_cache_entries{{cache="{name}"}} {stats["entries"]}' for name, stats in caches.items()]
+    return lines
+
+STAGE_SECONDS = Histogram("pricecompare_stage_seconds", "Time spent in each comparison pipeline stage.", ["stage"])
+UPSTREAM_SECONDS = Histogram("pricecompare_upstream_request_seconds", "Latency of upstream BuyHatke requests.", ["endpoint"])
+UPSTREAM_ERRORS = Counter("pricecompare_upstream_errors_total", "Failed upstream BuyHatke requests by error class.", ["endpoint", "error_class"])
+SCRAPED_ITEMS = Histogram("pricecompare_scraped_items", "Alternative prices found per tracker page.", buckets=(0, 1, 2, 5, 10, 20, 50))
+HTTP_REQUESTS = Counter("pricecompare_http_requests_total", "HTTP requests handled by the app.", ["endpoint", "method", "status"])
+HTTP_SECONDS = Histogram("pricecompare_http_request_seconds", "Time to produce an HTTP response.", ["endpoint"])
+
+def classify_upstream_error(exc):
+    """Maps an exception from an upstream call to a low-cardinality error class."""
+    if getattr(exc, "error_class", None):  # circuit.UpstreamUnavailable: "circuit_open" or "shed"
+        return exc.error_class
+    if isinstance(exc, requests.exceptions.Timeout):
+        return "timeout"
+    if isinstance(exc, requests.exceptions.ConnectionError):
+        return "connection"
+    if isinstance(exc, requests.exceptions.HTTPError):
+        status = getattr(exc.response, "status_code", None)
+        return f"http_{status // 100}xx" if status else "http"
+    if isinstance(exc, ValueError):
+        return "decode"
+    return "other"
+
+# --- Stage Timing ---
+
+_stage_listeners = []
+
+def add_stage_listener(func):
+    """Calls func(stage, seconds) for every timed stage (used by the benchmark)."""
+    _stage_listeners.append(func)
+    return func
+
+def record_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if has_request_context():
+        g.setdefault("server_timing", []).append((stage, seconds))
+    for listener in _stage_listeners:
+        listener(stage, seconds)
+
+@contextmanager
+def timed_stage(stage):
+    """Times the enclosed block as a pipeline stage (histogram + Server-Timing entry)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+def server_timing_header(entries):
+    """Formats (stage, seconds) pairs as a Server-Timing value, summing repeated stages."""
+    totals = {}
+    for stage, seconds in entries:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
+
+def init_app(app):
+    """Adds request timing, the Server-Timing header and HTTP metrics to a Flask app."""
+
+    @app.before_request
+    def _start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def _finish_timer(response):
+        start = g.get("request_start")
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or "unknown"
+        HTTP_SECONDS.observe(elapsed, endpoint=endpoint)
+        HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        entries = g.get("server_timing", []) + [("total", elapsed)]
+        response.headers["Server-Timing"] = server_timing_header(entries)
+        return response
+
+    return app
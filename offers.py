@@ -0,0 +1,98 @@
+import heapq
+from operator import attrgetter
+
+# --- Price Conversion ---
+
+def to_paise(value):
+    """Converts a rupee amount (number or numeric string) to integer paise, or None."""
+    if value is None:
+        return None
+    try:
+        return int(round(float(str(value).replace(',', '')) * 100))
+    except (ValueError, TypeError):
+        return None
+
+# --- Offer Model ---
+
+class Offer:
+    """
+    One seller's price for a product. `price` is the display string; `price_paise`
+    is the same amount as integer paise, or None when the price could not be parsed.
+    Offers are shared between requests (parse memo, single-flight) and must not be mutated.
+    """
+    __slots__ = ("seller", "title", "price", "link", "price_paise", "is_original")
+
+    def __init__(self, seller, title, price, link, price_paise=None, is_original=False):
+        self.seller = seller
+        self.title = title
+        self.price = price
+        self.link = link
+        self.price_paise = price_paise
+        self.is_original = is_original
+
+    @property
+    def price_numeric(self):
+        """Price in rupees as a float, or None."""
+        return self.price_paise / 100 if self.price_paise is not None else None
+
+    def to_dict(self):
+        data = {
+            "seller": self.seller,
+            "title": self.title,
+            "price": self.price,
+            "link": self.link,
+            "price_numeric": self.price_numeric,
+        }
+        if self.is_original:
+            data["is_original"] = True
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data.get("seller", "N/A"),
+            data.get("title", "N/A"),
+            data.get("price", "N/A"),
+            data.get("link", "#"),
+            to_paise(data.get("price_numeric")),
+            bool(data.get("is_original")),
+        )
+
+    def _key(self):
+        return (self.seller, self.title, self.price, self.link, self.price_paise, self.is_original)
+
+    def __eq__(self, other):
+        if not isinstance(other, Offer):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return f"Offer(seller={self.seller!r}, price={self.price!r}, price_paise={self.price_paise!r}, link={self.link!r})"
+
+# --- Selection Helpers ---
+# All of these compare price_paise directly and skip offers without a parsed price.
+
+_by_price = attrgetter("price_paise")
+
+def _priced(offers):
+    return (offer for offer in offers if offer.price_paise is not None)
+
+def lowest_offer(offers):
+    """The cheapest offer (the first one on ties), or None."""
+    return min(_priced(offers), key=_by_price, default=None)
+
+def cheapest_offers(offers, k):
+    """The k cheapest offers, cheapest first."""
+    return heapq.nsmallest(k, _priced(offers), key=_by_price)
+
+def best_offer_per_seller(offers):
+    """The cheapest priced offer of each seller, in order of the seller's first appearance."""
+    best = {}
+    for offer in _priced(offers):
+        current = best.get(offer.seller)
+        if current is None or offer.price_paise < current.price_paise:
+            best[offer.seller] = offer
+    return list(best.values())
@@ -0,0 +1,639 @@
+import logging
+import os
+import re
+import time
+from urllib.parse import urlparse
+
+import requests
+
+import http_client
+from cache import TTLCache, MemoryBackend, SQLiteBackend
+from circuit import CircuitBreaker, UpstreamUnavailable, metric_lines as circuit_metric_lines
+from offers import Offer, lowest_offer, to_paise
+from price_history import PriceHistoryStore
+from product_urls import ShortLinkResolver, canonical_product_url, canonicalize
+from singleflight import SingleFlight, metric_lines as singleflight_metric_lines
+from observability import (timed_stage, register_collector, cache_metric_lines, classify_upstream_error,
+                           UPSTREAM_SECONDS, UPSTREAM_ERRORS, SCRAPED_ITEMS)
+from tracker_cache import TrackerPageCache
+from tracker_parser import parse_alternatives
+
+# --- Comparison Pipeline ---
+# Everything from a product URL to a comparison result: PID extraction, the BuyHatke
+# API and tracker page, their caches, and the price history store. Used by the web
+# app (app.py) and the bulk CLI (scripts/bulk_compare.py).
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+BUYHATKE_BASE_URL = os.environ.get("BUYHATKE_BASE_URL", "https://buyhatke.com").rstrip("/")
+# User-Agent, pooling, timeouts and retries for upstream calls live in http_client.
+REQUEST_TIMEOUT = (http_client.CONNECT_TIMEOUT, http_client.READ_TIMEOUT)
+
+# --- Circuit Breaker Settings ---
+# One breaker per upstream endpoint; see circuit.py.
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", 5))  # consecutive failures that open the circuit
+BREAKER_RESET_TIMEOUT = float(os.environ.get("BREAKER_RESET_TIMEOUT", 30))  # seconds open before a probe is let through
+UPSTREAM_MAX_IN_FLIGHT = int(os.environ.get("UPSTREAM_MAX_IN_FLIGHT", http_client.POOL_MAXSIZE))  # per endpoint; beyond this calls are shed
+ADAPTIVE_TIMEOUT_MIN = float(os.environ.get("ADAPTIVE_TIMEOUT_MIN", 2.0))  # floor for the p99-derived read timeout
+ADAPTIVE_TIMEOUT_MULTIPLIER = float(os.environ.get("ADAPTIVE_TIMEOUT_MULTIPLIER", 3.0))
+
+# --- Product Data Cache Settings ---
+# Backend is "memory" (per worker) or "sqlite" (shared by all workers on the host).
+PRODUCT_CACHE_BACKEND = os.environ.get("PRODUCT_CACHE_BACKEND", "memory")
+PRODUCT_CACHE_PATH = os.environ.get("PRODUCT_CACHE_PATH", "product_cache.sqlite3")
+PRODUCT_CACHE_TTL = int(os.environ.get("PRODUCT_CACHE_TTL", 600))  # seconds an entry is fresh
+PRODUCT_CACHE_STALE_TTL = int(os.environ.get("PRODUCT_CACHE_STALE_TTL", 3600))  # extra seconds served stale
+PRODUCT_CACHE_MAX_ENTRIES = int(os.environ.get("PRODUCT_CACHE_MAX_ENTRIES", 5000))
+PRODUCT_CACHE_MAX_BYTES = int(os.environ.get("PRODUCT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# --- Short Link Settings ---
+SHORT_LINK_CACHE_TTL = int(os.environ.get("SHORT_LINK_CACHE_TTL", 7 * 86400))  # amzn.to / fkrt.it targets rarely change
+SHORT_LINK_CACHE_MAX_ENTRIES = int(os.environ.get("SHORT_LINK_CACHE_MAX_ENTRIES", 20000))
+
+# --- Tracker Page Cache Settings ---
+TRACKER_CACHE_ENABLED = os.environ.get("TRACKER_CACHE_ENABLED", "1") == "1"
+TRACKER_CACHE_BACKEND = os.environ.get("TRACKER_CACHE_BACKEND", "memory")  # "memory" or "sqlite"
+TRACKER_CACHE_PATH = os.environ.get("TRACKER_CACHE_PATH", "tracker_cache.sqlite3")
+TRACKER_CACHE_MAX_ENTRIES = int(os.environ.get("TRACKER_CACHE_MAX_ENTRIES", 5000))
+TRACKER_CACHE_MAX_BYTES = int(os.environ.get("TRACKER_CACHE_MAX_BYTES", 128 * 1024 * 1024))  # compressed HTML
+TRACKER_PARSE_MEMO_MAX_ENTRIES = int(os.environ.get("TRACKER_PARSE_MEMO_MAX_ENTRIES", 5000))
+
+# --- Price History Settings ---
+PRICE_HISTORY_ENABLED = os.environ.get("PRICE_HISTORY_ENABLED", "1") == "1"
+PRICE_HISTORY_PATH = os.environ.get("PRICE_HISTORY_PATH", "price_history.sqlite3")
+PRICE_HISTORY_SNAPSHOT_MAX_AGE = int(os.environ.get("PRICE_HISTORY_SNAPSHOT_MAX_AGE", 300))  # serve stored results this fresh; 0 disables
+PRICE_HISTORY_FALLBACK_MAX_AGE = int(os.environ.get("PRICE_HISTORY_FALLBACK_MAX_AGE", 3 * 86400))  # oldest snapshot used when BuyHatke fails
+PRICE_HISTORY_STATS_DAYS = int(os.environ.get("PRICE_HISTORY_STATS_DAYS", 30))
+PRICE_HISTORY_RAW_RETENTION_DAYS = int(os.environ.get("PRICE_HISTORY_RAW_RETENTION_DAYS", 7))  # then downsampled to daily
+PRICE_HISTORY_DAILY_RETENTION_DAYS = int(os.environ.get("PRICE_HISTORY_DAILY_RETENTION_DAYS", 365))
+
+# --- Upstream Circuit Breakers ---
+
+def _make_breaker(endpoint):
+    return CircuitBreaker(
+        endpoint,
+        failure_threshold=BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=BREAKER_RESET_TIMEOUT,
+        max_in_flight=UPSTREAM_MAX_IN_FLIGHT,
+        connect_timeout=http_client.CONNECT_TIMEOUT,
+        min_timeout=min(ADAPTIVE_TIMEOUT_MIN, http_client.READ_TIMEOUT),
+        max_timeout=http_client.READ_TIMEOUT,
+        timeout_multiplier=ADAPTIVE_TIMEOUT_MULTIPLIER,
+    )
+
+product_data_breaker = _make_breaker("product_data")
+tracker_page_breaker = _make_breaker("tracker_page")
+register_collector(lambda: circuit_metric_lines(product_data_breaker, tracker_page_breaker))
+
+# --- Helper Functions (API Fetch, Scraping) ---
+
+# BuyHatke "pos" (site position) for each supported site.
+SITE_POSITIONS = {"amazon": 63, "flipkart": 2}
+
+def product_data_url(product_id, site_type):
+    """BuyHatke productData API URL for a product, or None for an unsupported site_type."""
+    pos = SITE_POSITIONS.get(site_type)
+    if pos is None:
+        return None
+    return f"{BUYHATKE_BASE_URL}/api/productData?pos={pos}&pid={product_id}"
+
+def parse_product_data(data, site_type, product_id):
+    """
+    Extracts (product_name, price, tracker_url, thumbnails) from a decoded productData
+    response. Shared by the sync and async (async_pipeline.py) fetchers.
+    """
+    if data and "data" in data and data["data"] and isinstance(data["data"], dict):
+        product_data = data["data"]
+        product_name = product_data.get("name")
+        price = product_data.get("cur_price")
+        site_pos = product_data.get("site_pos")
+        internal_pid = product_data.get("internalPid")
+        
+        # Extract thumbnail images if available
+        thumbnails = product_data.get("thumbnailImages", [])
+        if not thumbnails and "image" in product_data:
+            # Fallback to main image if thumbnails not available
+            thumbnails = [product_data["image"]]
+
+        if product_name and site_pos is not None and internal_pid:
+            slug = re.sub(r'[^\w-]+', '-', product_name.lower()).strip('-')
+            if not slug: slug = f"product-{internal_pid}"
+            buyhatke_url = f"{BUYHATKE_BASE_URL}/{site_type}-{slug}-price-in-india-{site_pos}-{internal_pid}"
+
+            if not buyhatke_url.startswith(f"{BUYHATKE_BASE_URL}/"):
+                 logger.warning("Generated BuyHatke URL seems invalid: %s", buyhatke_url)
+                 return product_name, price, None, thumbnails
+            return product_name, price, buyhatke_url, thumbnails
+        else:
+             logger.warning("Missing required fields in API response data site=%s pid=%s", site_type, product_id)
+             return product_name, price, None, thumbnails # Return partial data if available
+    else:
+        UPSTREAM_ERRORS.inc(endpoint="product_data", error_class="unexpected_structure")
+        logger.error("API response structure unexpected site=%s pid=%s response=%.200s", site_type, product_id, data)
+        return None, None, None, None
+
+def fetch_price_from_buyhatke(product_id, site_type):
+    """
+    Fetches price and details from BuyHatke API using product_id and site_type.
+    Returns (product_name, price, tracker_url, thumbnails).
+    """
+    buyhatke_api_url = product_data_url(product_id, site_type)
+    if buyhatke_api_url is None:
+        logger.error("Unsupported site_type: %s", site_type)
+        return None, None, None, None
+
+    logger.info("Querying BuyHatke API site=%s pid=%s url=%s", site_type, product_id, buyhatke_api_url)
+    try:
+        # Fails fast while the circuit is open; the read timeout tracks observed latency.
+        with product_data_breaker.call() as timeout:
+            start = time.perf_counter()
+            try:
+                response = http_client.get(buyhatke_api_url, timeout=timeout)
+                response.raise_for_status()
+            finally:
+                UPSTREAM_SECONDS.observe(time.perf_counter() - start, endpoint="product_data")
+        return parse_product_data(response.json(), site_type, product_id)
+
+    except UpstreamUnavailable as e:
+        UPSTREAM_ERRORS.inc(endpoint="product_data", error_class=classify_upstream_error(e))
+        logger.warning("Skipped BuyHatke API call site=%s pid=%s: %s", site_type, product_id, e)
+        return None, None, None, None
+    except requests.exceptions.Timeout as e:
+        UPSTREAM_ERRORS.inc(endpoint="product_data", error_class=classify_upstream_error(e))
+        logger.error("Timeout fetching data from BuyHatke API site=%s pid=%s", site_type, product_id)
+        return None, None, None, None
+    except requests.exceptions.RequestException as e:
+        UPSTREAM_ERRORS.inc(endpoint="product_data", error_class=classify_upstream_error(e))
+        logger.error("Error fetching data from BuyHatke API site=%s pid=%s: %s", site_type, product_id, e)
+        return None, None, None, None
+    except ValueError as e: # JSON decode error
+        UPSTREAM_ERRORS.inc(endpoint="product_data", error_class=classify_upstream_error(e))
+        logger.error("Error decoding JSON response from BuyHatke API: %s raw=%.200s", e, response.text)
+        return None, None, None, None
+
+# --- Cached Product Data Lookup ---
+
+def make_product_key(site_type, product_id):
+    """Canonical key for a product, shared by the caches and the price history store."""
+    return f"{site_type}:{product_id}"
+
+def _make_product_cache():
+    if PRODUCT_CACHE_BACKEND == "sqlite":
+        backend = SQLiteBackend(PRODUCT_CACHE_PATH, max_entries=PRODUCT_CACHE_MAX_ENTRIES, max_bytes=PRODUCT_CACHE_MAX_BYTES)
+    else:
+        backend = MemoryBackend(max_entries=PRODUCT_CACHE_MAX_ENTRIES, max_bytes=PRODUCT_CACHE_MAX_BYTES)
+    # Only cache lookups that returned a name or a price; failures should be retried.
+    return TTLCache(backend, ttl=PRODUCT_CACHE_TTL, stale_ttl=PRODUCT_CACHE_STALE_TTL,
+                    cacheable=lambda result: result[0] is not None or result[1] is not None)
+
+product_cache = _make_product_cache()
+
+# --- Short Link Resolution ---
+
+short_link_resolver = ShortLinkResolver(
+    TTLCache(MemoryBackend(max_entries=SHORT_LINK_CACHE_MAX_ENTRIES), ttl=SHORT_LINK_CACHE_TTL, stale_ttl=0),
+    timeout=REQUEST_TIMEOUT,
+)
+cache_groups = {"product": product_cache, "short_link": short_link_resolver.cache}  # app.py adds its page cache
+register_collector(lambda: cache_metric_lines({name: cache.stats() for name, cache in cache_groups.items()}))
+
+# --- Tracker Page Cache ---
+
+def _make_tracker_cache():
+    if not TRACKER_CACHE_ENABLED:
+        return None
+    if TRACKER_CACHE_BACKEND == "sqlite":
+        pages = SQLiteBackend(TRACKER_CACHE_PATH, max_entries=TRACKER_CACHE_MAX_ENTRIES, max_bytes=TRACKER_CACHE_MAX_BYTES)
+    else:
+        pages = MemoryBackend(max_entries=TRACKER_CACHE_MAX_ENTRIES, max_bytes=TRACKER_CACHE_MAX_BYTES)
+    parsed = MemoryBackend(max_entries=TRACKER_PARSE_MEMO_MAX_ENTRIES)
+    return TrackerPageCache(pages, parsed)
+
+tracker_cache = _make_tracker_cache()
+if tracker_cache:
+    register_collector(tracker_cache.metric_lines)
+
+# In-flight deduplication of identical upstream lookups.
+product_data_flight = SingleFlight("product_data")
+tracker_page_flight = SingleFlight("tracker_page")
+flight_groups = [product_data_flight, tracker_page_flight]  # async_pipeline adds its own
+register_collector(lambda: singleflight_metric_lines(*flight_groups))
+
+def get_product_data(product_id, site_type, refresh=False):
+    """
+    Cached wrapper around fetch_price_from_buyhatke, keyed by (site_type, product_id).
+    With refresh=True the API is always called and the cache is overwritten.
+    Returns the same (product_name, price, tracker_url, thumbnails) tuple.
+    """
+    key = make_product_key(site_type, product_id)
+    # Concurrent misses (and background refreshes) for one product share a single API call.
+    loader = lambda: product_data_flight.do(key, lambda: fetch_price_from_buyhatke(product_id, site_type))
+    if refresh:
+        result = product_cache.refresh(key, loader)
+    else:
+        result = product_cache.get_or_load(key, loader)
+    return degraded_product_data(key, result)
+
+def degraded_product_data(key, result):
+    """
+    The degraded path for product data: while the API circuit is open, any cached
+    answer, however old, beats an error. Returns `result` unchanged otherwise.
+    """
+    if result[0] is None and result[1] is None and product_data_breaker.is_open():
+        return product_cache.peek(key) or result
+    return result
+
+# --- Price History Store ---
+
+history_store = PriceHistoryStore(
+    PRICE_HISTORY_PATH,
+    raw_retention_days=PRICE_HISTORY_RAW_RETENTION_DAYS,
+    daily_retention_days=PRICE_HISTORY_DAILY_RETENTION_DAYS,
+) if PRICE_HISTORY_ENABLED else None
+
+def scrape_buyhatke_alternatives(tracker_url):
+    """
+    Downloads the BuyHatke tracker page and scrapes alternative prices.
+    Concurrent calls for the same tracker URL share one download and parse.
+    Returns a list of Offers (seller, title, price, price_paise, link).
+    Returns None on download/parsing error, empty list if no items found.
+    """
+    if not tracker_url or not tracker_url.startswith("http"):
+        logger.info("Invalid or missing tracker URL provided. Cannot scrape alternatives.")
+        return None # Indicate error
+
+    alternatives = tracker_page_flight.do(tracker_url, lambda: _download_alternatives(tracker_url))
+    if alternatives is None:
+        return None
+    # Offers are shared and read-only; only the list itself is per caller.
+    return list(alternatives)
+
+def cached_alternatives(tracker_url):
+    """
+    Alternatives from the last downloaded copy of a tracker page, without contacting
+    BuyHatke, or None when no copy is cached. The degraded path while its circuit is open.
+    """
+    if not tracker_cache:
+        return None
+    parse = lambda body, encoding: parse_alternatives(body, tracker_url, encoding=encoding)
+    results = tracker_cache.last_known(tracker_url, parse, time.time())
+    return list(results) if results is not None else None
+
+def parse_tracker_response(tracker_url, cached_page, response):
+    """
+    Alternatives for a downloaded tracker page (CPU-bound: decompression, hashing and
+    parsing). `cached_page` is the page whose validators were sent with the request.
+    """
+    # Parse the raw bytes; the declared charset (if any) matches what response.text would use.
+    parse = lambda body, encoding: parse_alternatives(body, tracker_url, encoding=encoding)
+    with timed_stage("parse"):
+        if tracker_cache:
+            # A 304 or an unchanged body reuses the memoized parse result.
+            results = tracker_cache.alternatives_for(tracker_url, cached_page, response, parse, time.time())
+        else:
+            results = parse(response.content, response.encoding)
+    SCRAPED_ITEMS.observe(len(results))
+    return results
+
+def _download_alternatives(tracker_url):
+    """Download and parse step of scrape_buyhatke_alternatives (same return contract)."""
+    logger.info("Downloading BuyHatke page url=%s", tracker_url)
+
+    try:
+        # Revalidate a cached copy with If-None-Match / If-Modified-Since.
+        cached_page = tracker_cache.lookup(tracker_url) if tracker_cache else None
+        with timed_stage("html_download"), tracker_page_breaker.call() as timeout:
+            start = time.perf_counter()
+            try:
+                response = http_client.get(tracker_url, timeout=timeout,
+                                           headers=TrackerPageCache.conditional_headers(cached_page))
+                response.raise_for_status()
+            finally:
+                UPSTREAM_SECONDS.observe(time.perf_counter() - start, endpoint="tracker_page")
+        logger.debug("HTML downloaded status=%s bytes=%d", response.status_code, len(response.content))
+        return parse_tracker_response(tracker_url, cached_page, response)
+
+    except UpstreamUnavailable as e:
+        UPSTREAM_ERRORS.inc(endpoint="tracker_page", error_class=classify_upstream_error(e))
+        logger.warning("Skipped BuyHatke page download url=%s: %s", tracker_url, e)
+        return None
+    except requests.exceptions.Timeout as e:
+        UPSTREAM_ERRORS.inc(endpoint="tracker_page", error_class=classify_upstream_error(e))
+        logger.error("Timeout downloading BuyHatke page HTML url=%s", tracker_url)
+        return None # Indicate download error
+    except requests.exceptions.RequestException as e:
+        UPSTREAM_ERRORS.inc(endpoint="tracker_page", error_class=classify_upstream_error(e))
+        logger.error("Error downloading BuyHatke page HTML url=%s: %s", tracker_url, e)
+        return None # Indicate download error
+    except Exception:
+        logger.exception("Unexpected error during scraping url=%s", tracker_url)
+        return None # Indicate scraping error
+
+# --- Comparison Pipeline ---
+
+_product_request_listeners = []
+
+def add_product_request_listener(func):
+    """Calls func(product_key) whenever compare_product handles a detected product."""
+    _product_request_listeners.append(func)
+    return func
+
+def find_lowest_price_option(alternatives, original_offer):
+    """
+    Finds the cheapest option among the scraped alternatives and the original listing.
+    Returns the winning Offer (the original has is_original set) or None.
+    """
+    lowest = lowest_offer(alternatives)
+    if original_offer.price_paise is not None and (lowest is None or original_offer.price_paise < lowest.price_paise):
+        return original_offer
+    return lowest
+
+def detect_product(input_url):
+    """
+    Detects the site of a product URL and extracts its product ID.
+    Returns (site_type, product_id, original_domain, error).
+    """
+    site_type = None
+    product_id = None
+    error = None
+    original_domain = "N/A" # Default value
+    with timed_stage("pid_extraction"):
+        try:
+            parsed_url = urlparse(input_url)
+            domain = parsed_url.netloc.lower()
+            original_domain = domain # Store the extracted domain
+
+            # Mobile, /gp/aw/d/, tracking-parameter and short-link variants share one key.
+            site_type, product_id = canonicalize(input_url, short_link_resolver)
+            if site_type is None:
+                error = "URL does not appear to be a valid Amazon or Flipkart link."
+
+        except Exception as e:
+            error = f"Error parsing input URL: {e}"
+            site_type = None # Prevent further processing
+
+    if site_type and not product_id:
+        error = f"Could not extract Product ID ({'ASIN' if site_type == 'amazon' else 'PID'}) from the {site_type.capitalize()} URL. Please check the link."
+    elif not site_type and not error: # URL was invalid or unsupported
+        error = "Could not process the provided URL. Please ensure it's a valid Amazon or Flipkart product link."
+    return site_type, product_id, original_domain, error
+
+def canonical_product(site_type, product_id):
+    """
+    detect_product for a (site_type, product_id) pair given directly, as the API takes
+    them: returns (site_type, product_id, error) with the ID spelled as in the product
+    keys (e.g. an upper-cased ASIN). site_type must be "amazon" or "flipkart".
+    """
+    site_type, product_id, _, error = detect_product(canonical_product_url(site_type, product_id))
+    return site_type, product_id, error
+
+def fetch_product_details(input_url, site_type, product_id, original_domain, refresh=False):
+    """
+    BuyHatke API lookup for a detected product (first half of fetch_comparison).
+    refresh=True bypasses (and then updates) the product data cache.
+    Returns (product_info, tracker_url, error); error is set when the API call failed,
+    in which case product_info only carries the original URL and domain.
+    """
+    # Fetch initial details from BuyHatke API
+    with timed_stage("api_fetch"):
+        api_result = get_product_data(product_id, site_type, refresh=refresh)
+    return build_product_details(input_url, site_type, product_id, original_domain, api_result)
+
+def build_product_details(input_url, site_type, product_id, original_domain, api_result):
+    """fetch_product_details' result for a (product_name, price, tracker_url, thumbnails) API answer."""
+    api_name, api_price, tracker_url, thumbnails = api_result
+    if api_name is None and api_price is None:
+        error = f"Failed to fetch initial details for {product_id} from BuyHatke API. Product might not be tracked or API issue."
+        # Pass back basic info even on failure
+        product_info = {
+            "original_url": input_url,
+            "original_domain": original_domain
+        }
+        return product_info, None, error
+
+    price_display = 'N/A'
+    original_price_numeric = None
+
+    if api_price is not None:
+        try:
+            original_price_numeric = float(api_price)
+            price_display = f"₹{original_price_numeric:,.2f}"
+        except (ValueError, TypeError):
+            price_display = f"₹{api_price}"
+
+    # Include the extracted domain in product_info
+    product_info = {
+        "name": api_name or "N/A",
+        "price": price_display,
+        "price_numeric": original_price_numeric,
+        "tracker_url": tracker_url,
+        "original_url": input_url,
+        "original_domain": original_domain,
+        "site_type": site_type,
+        "thumbnails": thumbnails
+    }
+    return product_info, tracker_url, None
+
+def fetch_alternatives(product_info, tracker_url, input_url, site_type):
+    """
+    Alternatives scrape and lowest-price scan (second half of fetch_comparison).
+    Returns (result, upstream_failed) like fetch_comparison.
+    """
+    alternatives = scrape_buyhatke_alternatives(tracker_url) if tracker_url else None
+    degraded = bool(tracker_url) and alternatives is None and tracker_page_breaker.is_open()
+    cached = cached_alternatives(tracker_url) if degraded else None
+    return build_alternatives_result(product_info, tracker_url, input_url, site_type, alternatives, degraded, cached)
+
+def build_alternatives_result(product_info, tracker_url, input_url, site_type, alternatives, degraded=False, cached=None):
+    """
+    fetch_alternatives' (result, upstream_failed) for a scrape outcome. `degraded` is set
+    when the scrape failed with the tracker page circuit open; `cached` is then the
+    cached_alternatives() fallback, if any.
+    """
+    error = None
+    notice = None
+    lowest_price_option = None
+    upstream_failed = False
+
+    if tracker_url:
+        if degraded:
+            # Degraded path: the last cached copy of the page, else the API data alone.
+            # Either way this counts as an upstream failure, so a stored snapshot still wins.
+            upstream_failed = True
+            alternatives = cached
+            if alternatives is None:
+                error = "Could not fetch alternative prices (BuyHatke is not responding)."
+                notice = "BuyHatke price pages are not responding; showing product details only."
+                alternatives = []
+            else:
+                notice = "BuyHatke price pages are not responding; showing the last prices we fetched."
+        if alternatives is None:
+            error = "Could not fetch alternative prices (scraping error)."
+            alternatives = []
+            upstream_failed = True
+        elif not alternatives:
+            logger.info("No alternative prices found on the tracker page.")
+        else:
+            original_offer = Offer(site_type.capitalize(), product_info["name"], product_info["price"], input_url,
+                                   to_paise(product_info["price_numeric"]), is_original=True)
+            with timed_stage("lowest_price_scan"):
+                lowest_price_option = find_lowest_price_option(alternatives, original_offer)
+            if lowest_price_option:
+                logger.info("Lowest price found: %s - %s", lowest_price_option.seller, lowest_price_option.price)
+    else:
+        error = "Could not construct BuyHatke tracker URL. Cannot fetch alternatives."
+        alternatives = [] # Ensure alternatives is iterable
+
+    result = {
+        "error": error,
+        "product_info": product_info,
+        "alternatives": alternatives,
+        "lowest_price_option": lowest_price_option,
+        "notice": notice,
+    }
+    return result, upstream_failed
+
+def fetch_comparison(input_url, site_type, product_id, original_domain, refresh=False):
+    """
+    BuyHatke API lookup, alternatives scrape and lowest-price scan for a detected product.
+    refresh=True bypasses (and then updates) the product data cache.
+    Returns (result, upstream_failed) where result is the compare_product dict and
+    upstream_failed tells whether the API call or the scrape failed.
+    """
+    product_info, tracker_url, error = fetch_product_details(input_url, site_type, product_id, original_domain, refresh)
+    if error:
+        return failed_result(error, product_info), True
+    return fetch_alternatives(product_info, tracker_url, input_url, site_type)
+
+def failed_result(error, product_info):
+    return {
+        "error": error,
+        "product_info": product_info,
+        "alternatives": [], # Ensure alternatives is iterable
+        "lowest_price_option": None,
+        "notice": None,
+    }
+
+def snapshot_result(snapshot, input_url, original_domain, notice):
+    """Adapts a stored comparison result to the current request."""
+    result, captured_at = snapshot
+    result["product_info"]["original_url"] = input_url
+    result["product_info"]["original_domain"] = original_domain
+    result["snapshot_captured_at"] = captured_at
+    result["notice"] = notice
+    return result
+
+def compare_product(input_url, note_request=True):
+    """
+    Runs the full comparison for one product URL: site detection and PID extraction,
+    BuyHatke API lookup, alternatives scrape and lowest-price scan.
+    A recent stored snapshot is served instead when available, and an older one is
+    used as a fallback when BuyHatke fails.
+    Returns a dict with error, product_info, alternatives, lowest_price_option,
+    price_history, notice and snapshot_captured_at.
+    note_request=False skips the product request listeners, for callers that
+    already told them (the permalink route, which may not compare at all).
+    """
+    for _, result in compare_product_stages(input_url, note_request):
+        pass
+    return result
+
+def compare_product_stages(input_url, note_request=True):
+    """
+    Generator form of compare_product for progressive rendering. Yields (stage, result):
+    when the result has to be fetched live, ("product", partial) with product_info
+    only is yielded as soon as the BuyHatke API answers; the last yield is always
+    ("complete", result) with the compare_product result.
+    """
+    logger.info("Processing URL: %s", input_url)
+
+    site_type, product_id, original_domain, error = detect_product(input_url)
+    if error:
+        yield "complete", stage_result(error=error)
+        return
+
+    if note_request:
+        product_key = note_product_request(site_type, product_id)
+    else:
+        product_key = make_product_key(site_type, product_id)
+    snapshot = lookup_snapshot(product_key)
+    if snapshot:
+        result = snapshot_result(snapshot, input_url, original_domain, None)
+    else:
+        product_info, tracker_url, error = fetch_product_details(input_url, site_type, product_id, original_domain)
+        if error:
+            result, upstream_failed = failed_result(error, product_info), True
+        else:
+            yield "product", stage_result(product_info=product_info)
+            result, upstream_failed = fetch_alternatives(product_info, tracker_url, input_url, site_type)
+        result = settle_live_result(product_key, result, upstream_failed, input_url, original_domain)
+    yield "complete", attach_price_history(product_key, result)
+
+# Steps of compare_product_stages shared with the async pipeline (async_pipeline.py),
+# which runs the blocking ones (SQLite) on a thread.
+
+def stage_result(error=None, product_info=None):
+    """A compare_product-shaped result with only an error or product_info filled in."""
+    return {
+        "error": error,
+        "product_info": product_info,
+        "alternatives": None,
+        "lowest_price_option": None,
+        "price_history": None,
+        "notice": None,
+        "snapshot_captured_at": None,
+    }
+
+def note_product_request(site_type, product_id):
+    """Tells the product request listeners about a lookup and returns the product key."""
+    logger.info("Detected %s URL. Extracted %s: %s", site_type, 'ASIN' if site_type == 'amazon' else 'PID', product_id)
+    product_key = make_product_key(site_type, product_id)
+    for listener in _product_request_listeners:
+        listener(product_key)
+    return product_key
+
+def lookup_snapshot(product_key):
+    """A stored result recent enough to serve instead of fetching, or None."""
+    if not history_store or PRICE_HISTORY_SNAPSHOT_MAX_AGE <= 0:
+        return None
+    with timed_stage("snapshot_lookup"):
+        return history_store.latest_snapshot(product_key, PRICE_HISTORY_SNAPSHOT_MAX_AGE)
+
+def settle_live_result(product_key, result, upstream_failed, input_url, original_domain):
+    """Records a live result, or swaps in an older stored snapshot if BuyHatke failed."""
+    result["snapshot_captured_at"] = None
+    if history_store:
+        if upstream_failed:
+            fallback = history_store.latest_snapshot(product_key, PRICE_HISTORY_FALLBACK_MAX_AGE)
+            if fallback:
+                logger.warning("Serving stored snapshot for %s after upstream failure", product_key)
+                result = snapshot_result(fallback, input_url, original_domain,
+                                          "BuyHatke is not responding; showing the last saved prices.")
+        else:
+            history_store.record(product_key, result)
+    return result
+
+def attach_price_history(product_key, result):
+    """Adds the per-seller price history stats to a result."""
+    result["price_history"] = None
+    if history_store and result["product_info"] and result["product_info"].get("name"):
+        with timed_stage("history_lookup"):
+            result["price_history"] = history_store.seller_stats(product_key, PRICE_HISTORY_STATS_DAYS)
+    return result
+
+def result_to_json(input_url, result):
+    """JSON-ready form of a compare_product result, as returned by /api/compare."""
+    return {
+        "url": input_url,
+        # A failed API lookup still returns product_info (the original URL and domain),
+        # so the status comes from whether the product itself was found.
+        "status": "error" if result["error"] and not (result["product_info"] or {}).get("name") else "ok",
+        "error": result["error"],
+        "product": result["product_info"],
+        "alternatives": [offer.to_dict() for offer in result["alternatives"]] if result["alternatives"] is not None else None,
+        "lowest_price_option": result["lowest_price_option"].to_dict() if result["lowest_price_option"] else None,
+        "price_history": result["price_history"],
+        "notice": result["notice"],
+        "snapshot_captured_at": result["snapshot_captured_at"],
+    }
@@ -0,0 +1,268 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from offers import Offer, to_paise
+
+logger = logging.getLogger(__name__)
+
+DAY_SECONDS = 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prices (
+    product_key TEXT NOT NULL,
+    seller TEXT NOT NULL,
+    price_paise INTEGER NOT NULL,
+    captured_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_prices_product_seller_time ON prices (product_key, seller, captured_at);
+CREATE INDEX IF NOT EXISTS idx_prices_time ON prices (captured_at);
+
+CREATE TABLE IF NOT EXISTS prices_daily (
+    product_key TEXT NOT NULL,
+    seller TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    min_paise INTEGER NOT NULL,
+    max_paise INTEGER NOT NULL,
+    sum_paise INTEGER NOT NULL,
+    samples INTEGER NOT NULL,
+    PRIMARY KEY (product_key, seller, day)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS snapshots (
+    product_key TEXT PRIMARY KEY,
+    captured_at REAL NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_snapshots_time ON snapshots (captured_at);
+"""
+
+def _snapshot_payload(result):
+    """JSON for a comparison result, with Offers stored as plain dicts."""
+    payload = dict(result)
+    payload["alternatives"] = [offer.to_dict() for offer in result.get("alternatives") or []]
+    lowest = result.get("lowest_price_option")
+    payload["lowest_price_option"] = lowest.to_dict() if lowest is not None else None
+    return json.dumps(payload)
+
+def _snapshot_result(payload):
+    result = json.loads(payload)
+    result["alternatives"] = [Offer.from_dict(item) for item in result.get("alternatives") or []]
+    lowest = result.get("lowest_price_option")
+    result["lowest_price_option"] = Offer.from_dict(lowest) if lowest is not None else None
+    return result
+
+
+class PriceHistoryStore:
+    """
+    SQLite store of comparison results.
+
+    - `prices` holds raw (product, seller, price) samples; samples older than
+      raw_retention_days are folded into per-day min/max/sum rows in `prices_daily`
+      and deleted, and daily rows older than daily_retention_days are dropped.
+    - `snapshots` keeps the latest full comparison result per product so it can be
+      served without any upstream call.
+
+    Writes are queued and committed in batches by a background thread, so the
+    request path only pays for a queue put.
+    """
+
+    def __init__(self, path, batch_size=200, flush_interval=1.0, raw_retention_days=7,
+                 daily_retention_days=365, maintenance_interval=3600):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.raw_retention_days = raw_retention_days
+        self.daily_retention_days = daily_retention_days
+        self.maintenance_interval = maintenance_interval
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self.dropped_writes = 0
+
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+
+    # --- Connections ---
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    # --- Writes ---
+
+    def record(self, product_key, result, captured_at=None):
+        """
+        Queues a comparison result (the dict returned by compare_product) for storage.
+        Only results with product details are stored.
+        """
+        product_info = result.get("product_info") or {}
+        if not product_info.get("name"):
+            return
+        self._ensure_writer()
+        self._queue.put((product_key, result, captured_at or time.time()))
+
+    def _ensure_writer(self):
+        if self._writer is not None and self._writer.is_alive():
+            return
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._writer_loop, name="price-history-writer", daemon=True)
+                self._writer.start()
+
+    def _writer_loop(self):
+        conn = self._connect()
+        last_maintenance = time.monotonic()
+        while True:
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            if batch:
+                try:
+                    self._write_batch(conn, batch)
+                except sqlite3.Error:
+                    self.dropped_writes += len(batch)
+                    logger.exception("Failed to write %d price history records", len(batch))
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+
+            if time.monotonic() - last_maintenance > self.maintenance_interval:
+                last_maintenance = time.monotonic()
+                try:
+                    self.compact(conn)
+                except sqlite3.Error:
+                    logger.exception("Price history maintenance failed")
+
+    def _write_batch(self, conn, batch):
+        price_rows = []
+        snapshot_rows = []
+        for product_key, result, captured_at in batch:
+            product_info = result["product_info"]
+            original_paise = to_paise(product_info.get("price_numeric"))
+            if original_paise is not None:
+                seller = (product_info.get("site_type") or "original").capitalize()
+                price_rows.append((product_key, seller, original_paise, captured_at))
+            for offer in result.get("alternatives") or []:
+                if offer.price_paise is not None and offer.seller not in (None, "N/A"):
+                    price_rows.append((product_key, offer.seller, offer.price_paise, captured_at))
+            snapshot_rows.append((product_key, captured_at, _snapshot_payload(result)))
+
+        conn.execute("BEGIN")
+        try:
+            conn.executemany("INSERT INTO prices (product_key, seller, price_paise, captured_at) VALUES (?, ?, ?, ?)", price_rows)
+            conn.executemany(
+                "INSERT INTO snapshots (product_key, captured_at, payload) VALUES (?, ?, ?) "
+                "ON CONFLICT(product_key) DO UPDATE SET captured_at = excluded.captured_at, payload = excluded.payload "
+                "WHERE excluded.captured_at >= snapshots.captured_at",
+                snapshot_rows,
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def flush(self, timeout=None):
+        """Blocks until queued writes are committed (used by tests, CLI runs and shutdown)."""
+        if self._writer is None:
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return
+            time.sleep(0.01)
+
+    # --- Retention ---
+
+    def compact(self, conn=None, now=None):
+        """Folds old raw samples into daily aggregates and drops expired rows."""
+        conn = conn or self._conn()
+        now = now or time.time()
+        raw_cutoff = now - self.raw_retention_days * DAY_SECONDS
+        daily_cutoff_day = int((now - self.daily_retention_days * DAY_SECONDS) // DAY_SECONDS)
+
+        conn.execute("BEGIN")
+        try:
+            conn.execute(
+                """
+                INSERT INTO prices_daily (product_key, seller, day, min_paise, max_paise, sum_paise, samples)
+                SELECT product_key, seller, CAST(captured_at / ? AS INTEGER) AS day,
+                       MIN(price_paise), MAX(price_paise), SUM(price_paise), COUNT(*)
+                FROM prices WHERE captured_at < ?
+                GROUP BY product_key, seller, day
+                ON CONFLICT(product_key, seller, day) DO UPDATE SET
+                    min_paise = MIN(prices_daily.min_paise, excluded.min_paise),
+                    max_paise = MAX(prices_daily.max_paise, excluded.max_paise),
+                    sum_paise = prices_daily.sum_paise + excluded.sum_paise,
+                    samples = prices_daily.samples + excluded.samples
+                """,
+                (DAY_SECONDS, raw_cutoff),
+            )
+            conn.execute("DELETE FROM prices WHERE captured_at < ?", (raw_cutoff,))
+            conn.execute("DELETE FROM prices_daily WHERE day < ?", (daily_cutoff_day,))
+            conn.execute("DELETE FROM snapshots WHERE captured_at < ?", (now - self.daily_retention_days * DAY_SECONDS,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    # --- Reads ---
+
+    def latest_snapshot(self, product_key, max_age):
+        """Returns (result, captured_at) for the newest snapshot younger than max_age seconds, or None."""
+        row = self._conn().execute(
+            "SELECT payload, captured_at FROM snapshots WHERE product_key = ? AND captured_at >= ?",
+            (product_key, time.time() - max_age),
+        ).fetchone()
+        if row is None:
+            return None
+        return _snapshot_result(row[0]), row[1]
+
+    def seller_stats(self, product_key, days=30):
+        """
+        Per-seller min/max/avg price (in rupees) over the last `days` days, combining raw
+        samples with downsampled daily rows. Sorted by lowest minimum price.
+        """
+        since = time.time() - days * DAY_SECONDS
+        rows = self._conn().execute(
+            """
+            SELECT seller, MIN(min_p), MAX(max_p), SUM(sum_p), SUM(n), MAX(last_seen) FROM (
+                SELECT seller, MIN(price_paise) AS min_p, MAX(price_paise) AS max_p,
+                       SUM(price_paise) AS sum_p, COUNT(*) AS n, MAX(captured_at) AS last_seen
+                FROM prices WHERE product_key = ? AND captured_at >= ? GROUP BY seller
+                UNION ALL
+                SELECT seller, MIN(min_paise), MAX(max_paise), SUM(sum_paise), SUM(samples), MAX((day + 1) * ?)
+                FROM prices_daily WHERE product_key = ? AND day >= ? GROUP BY seller
+            ) GROUP BY seller ORDER BY MIN(min_p)
+            """,
+            (product_key, since, DAY_SECONDS, product_key, int(since // DAY_SECONDS)),
+        ).fetchall()
+        return [
+            {
+                "seller": seller,
+                "min_price": min_p / 100,
+                "max_price": max_p / 100,
+                "avg_price": round(sum_p / n / 100, 2),
+                "samples": n,
+                "last_seen": last_seen,
+            }
+            for seller, min_p, max_p, sum_p, n, last_seen in rows
+        ]
@@ -0,0 +1,125 @@
+import logging
+import re
+from urllib.parse import urlparse, parse_qs
+
+import requests
+
+import http_client
+
+logger = logging.getLogger(__name__)
+
+# --- Product URL Canonicalisation ---
+# Maps the many shapes of an Amazon / Flipkart product link (desktop, mobile,
+# /gp/aw/d/, affiliate and tracking parameters, short links) to one
+# (site_type, product_id) pair, so every variant shares cache and history keys.
+
+# Short-link hosts -> the site their redirect lands on.
+SHORT_LINK_HOSTS = {
+    "amzn.to": "amazon",
+    "amzn.in": "amazon",
+    "amzn.eu": "amazon",
+    "a.co": "amazon",
+    "fkrt.it": "flipkart",
+    "fkrt.cc": "flipkart",
+    "fkrt.co": "flipkart",
+}
+# dl.flipkart.com/s/<code> is a short link; dl.flipkart.com/dl/... carries the pid itself.
+FLIPKART_SHORT_PATH = re.compile(r'^/s/[\w-]+/?$')
+
+RE_AMAZON_HOST = re.compile(r'(?:^|\.)amazon\.(?:[a-z]{2,3}|co\.[a-z]{2}|com\.[a-z]{2})$')
+RE_FLIPKART_HOST = re.compile(r'(?:^|\.)flipkart\.com$')
+
+# ASINs follow one of these path segments; "/gp/aw/d/" is the old mobile layout.
+RE_AMAZON_PID = re.compile(
+    r'/(?:dp|gp/product|gp/aw/d|gp/offer-listing|exec/obidos/asin|o/asin|product)/([A-Z0-9]{10})(?=[/?#;]|$)',
+    re.IGNORECASE,
+)
+RE_FLIPKART_PID = re.compile(r'[?&]pid=([A-Z0-9]+)', re.IGNORECASE)
+
+def site_for_hostname(hostname):
+    """"amazon", "flipkart" or None for a (lowercase) hostname, short-link hosts included."""
+    if RE_AMAZON_HOST.search(hostname):
+        return "amazon"
+    if RE_FLIPKART_HOST.search(hostname):
+        return "flipkart"
+    return SHORT_LINK_HOSTS.get(hostname)
+
+def is_short_link(parsed):
+    hostname = parsed.hostname or ""
+    if hostname in SHORT_LINK_HOSTS:
+        return True
+    return hostname == "dl.flipkart.com" and bool(FLIPKART_SHORT_PATH.match(parsed.path))
+
+def extract_amazon_pid(url):
+    """The ASIN (upper-cased) from any Amazon product URL shape, or None."""
+    parsed = urlparse(url)
+    match = RE_AMAZON_PID.search(parsed.path)
+    if match:
+        return match.group(1).upper()
+    # Some share and affiliate links only carry the ASIN as a query parameter.
+    query = {k.lower(): v for k, v in parse_qs(parsed.query).items()}
+    for value in query.get("asin", []):
+        if re.fullmatch(r'[A-Z0-9]{10}', value, re.IGNORECASE):
+            return value.upper()
+    return None
+
+def extract_flipkart_pid(url):
+    """The pid (upper-cased) from a Flipkart product URL, or None."""
+    values = parse_qs(urlparse(url).query).get("pid")
+    if values and values[0].strip():
+        return values[0].strip().upper()
+    match = RE_FLIPKART_PID.search(url)
+    return match.group(1).upper() if match else None
+
+PID_EXTRACTORS = {"amazon": extract_amazon_pid, "flipkart": extract_flipkart_pid}
+
+def canonical_product_url(site_type, product_id):
+    """The canonical product URL for a (site_type, product_id) pair."""
+    if site_type == "amazon":
+        return f"https://www.amazon.in/dp/{product_id}"
+    return f"https://www.flipkart.com/product/p/itm?pid={product_id}"
+
+# --- Short Link Resolution ---
+
+class ShortLinkResolver:
+    """
+    Follows amzn.to / fkrt.it / dl.flipkart.com/s/ redirects to the product URL.
+    Resolutions are kept in `cache` (a TTLCache) since a short link never changes target.
+    """
+
+    def __init__(self, cache, timeout=None):
+        self.cache = cache
+        self.timeout = timeout
+
+    def resolve(self, url):
+        """The final URL after redirects, or None if it could not be fetched."""
+        return self.cache.get_or_load(url, lambda: self._follow(url))
+
+    def _follow(self, url):
+        try:
+            response = http_client.request("HEAD", url, timeout=self.timeout, allow_redirects=True)
+            if response.status_code >= 400:  # Some shorteners only redirect GETs
+                response = http_client.get(url, timeout=self.timeout, allow_redirects=True, stream=True)
+                response.close()
+            return response.url
+        except requests.exceptions.RequestException as e:
+            logger.warning("Could not resolve short link %s: %s", url, e)
+            return None
+
+def canonicalize(url, resolver=None):
+    """
+    Returns (site_type, product_id) for a product URL. site_type is None for
+    unsupported sites; product_id is None when no ID was found (including short
+    links when no resolver is given or the redirect could not be followed).
+    """
+    parsed = urlparse(url)
+    site_type = site_for_hostname((parsed.hostname or "").lower())
+    if site_type is None:
+        return None, None
+    if is_short_link(parsed):
+        target = resolver.resolve(url) if resolver else None
+        if not target or is_short_link(urlparse(target)):
+            return site_type, None
+        target_site, product_id = canonicalize(target)
+        return (target_site or site_type), product_id
+    return site_type, PID_EXTRACTORS[site_type](url)
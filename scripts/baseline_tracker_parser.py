@@ -0,0 +1,153 @@
+"""
+Frozen copy of the tracker-page parsing in the original app.py
+(scrape_buyhatke_alternatives, before tracker_parser existed), used as the
+reference by check_parser_parity.py. Only the download, the prints and the
+error handling were removed. Do not change it to match tracker_parser.
+"""
+import html
+import re
+from urllib.parse import urlparse, parse_qs
+
+import requests
+from bs4 import BeautifulSoup
+
+def scrape_alternatives(text, tracker_url):
+    """The original parser's results for a decoded tracker page: a list of seller/title/price/link dicts."""
+    results = [] # Initialize list to store results
+
+    soup = BeautifulSoup(text, 'html.parser') # Use html.parser or html5lib
+
+    # --- Find the price list (robust finding logic) ---
+    price_list = None
+    # Try specific ID first
+    price_section_by_id = soup.find('section', id='onlineStoresList')
+    if price_section_by_id:
+        price_list = price_section_by_id.find('ul', class_=re.compile(r'my-4 grid'))
+
+    # Try common structure/text if ID fails
+    if not price_list:
+        price_section_by_text = soup.find('section', class_='grid', string=lambda t: t and "Found" in t and "more prices" in t)
+        if price_section_by_text:
+            price_list = price_section_by_text.find('ul', class_=re.compile(r'my-4 grid'))
+
+    # Generic fallback if specific methods fail
+    if not price_list:
+        all_lists = soup.find_all('ul', class_=re.compile(r'my-4 grid'))
+        # Add logic here if needed to distinguish the correct list if multiple match
+        if all_lists:
+             price_list = all_lists[0] # Assume the first one is correct for now
+
+    # --- Process list items ---
+    if not price_list:
+        return [] # Return empty list, not an error, just no items found
+
+    list_items = price_list.find_all('li', recursive=False)
+
+    if not list_items:
+        return [] # Return empty list
+
+    for item in list_items:
+        seller_name = "N/A"
+        product_title = "N/A"
+        price_str = "N/A"
+        buy_link = "#" # Default link to avoid errors
+
+        # Seller Name Extraction
+        img_container = item.find('div', class_=re.compile(r'\bflex\b.*\bitems-center\b'))
+        if img_container:
+             img_tag = img_container.find('img', class_=re.compile(r'\brounded-full\b'), alt=True)
+             if img_tag and img_tag.get('alt'):
+                  seller_name = img_tag['alt'].strip()
+        if seller_name == "N/A" and img_container: # Fallback to src parsing
+            img_tag = img_container.find('img', class_=re.compile(r'\brounded-full\b'), src=True)
+            if img_tag:
+                src_url = img_tag.get('src', '')
+                match = re.search(r'/([^/]+?)(?:1|_m)?\.(?:png|jpe?g|webp|svg)', src_url, re.IGNORECASE)
+                if match:
+                    raw_name = match.group(1)
+                    seller_name = raw_name.replace('-', ' ').replace('_', ' ').title()
+                    corrections = {'Vsales': 'Vijay Sales', 'Flipkart': 'Flipkart', 'Amazon': 'Amazon', 'Jiomart' : 'JioMart', 'Reliancedigital': 'Reliance Digital', 'Tatacliq': 'Tata CLiQ', 'Croma': 'Croma'}
+                    seller_name = corrections.get(seller_name, seller_name)
+
+        # Product Title Extraction
+        title_p_tag = item.find('p', title=True)
+        if title_p_tag: product_title = html.unescape(title_p_tag['title'].strip())
+        else:
+             title_p_tag = item.find('p', class_='capitalize')
+             if title_p_tag:
+                  # Prioritize the longer title if available (often more complete)
+                  span_hidden_md = title_p_tag.find('span', class_='hidden md:inline')
+                  span_md_hidden = title_p_tag.find('span', class_='md:hidden')
+                  if span_hidden_md and len(span_hidden_md.get_text(strip=True)) > 5 : # Check length as heuristic
+                       product_title = html.unescape(span_hidden_md.get_text(strip=True))
+                  elif span_md_hidden:
+                       product_title = html.unescape(span_md_hidden.get_text(strip=True))
+                  else: # Fallback to the whole paragraph text
+                       product_title = html.unescape(title_p_tag.get_text(strip=True))
+
+        # Price Extraction
+        price_container = item.find('div', class_=re.compile(r'flex justify-between'))
+        if price_container:
+            price_span = price_container.find('span', class_='font-bold')
+            if price_span:
+                raw_price = price_span.get_text(strip=True)
+                price_match = re.search(r'([\d,]+(?:\.\d+)?)', raw_price)
+                if price_match: price_str = f"₹{price_match.group(1)}"
+                else: price_str = raw_price
+            else:
+                price_p_tag = price_container.find('p', string=re.compile(r'₹'))
+                if price_p_tag:
+                     raw_price = price_p_tag.get_text(strip=True)
+                     price_match = re.search(r'₹\s*([\d,]+(?:\.\d+)?)', raw_price)
+                     if price_match: price_str = f"₹{price_match.group(1)}"
+                     else: price_str = raw_price
+
+        # Buy Link Extraction
+        # Look within price container first
+        if price_container:
+            buy_a_tag = price_container.find('a', href=True, class_=re.compile(r'\btext-primary\b'))
+            if not buy_a_tag: buy_a_tag = price_container.find('a', href=True, string=re.compile(r'Buy'))
+            if buy_a_tag: buy_link = buy_a_tag['href']
+
+        # Fallback: Search entire list item if not found above
+        if buy_link == "#": # Use default value check
+            buy_a_tag = item.find('a', href=True, string=re.compile(r'Buy'))
+            if buy_a_tag: buy_link = buy_a_tag['href']
+
+        # Resolve relative URLs
+        if buy_link.startswith('/'):
+             buy_link = requests.compat.urljoin(tracker_url, buy_link)
+
+        # Final Fallback: Seller from Buy Link Hostname
+        if seller_name == "N/A" and buy_link != "#" and buy_link.startswith("http"):
+            try:
+                target_url = buy_link
+                parsed_buy_link = urlparse(buy_link)
+                if 'tracking.buyhatke.com' in parsed_buy_link.netloc:
+                    query_params = parse_qs(parsed_buy_link.query)
+                    if 'link' in query_params and query_params['link']:
+                        target_url = query_params['link'][0]
+                parsed_target_url = urlparse(target_url)
+                hostname = parsed_target_url.netloc.lower()
+                if 'amazon.in' in hostname or 'amazon.com' in hostname: seller_name = 'Amazon'
+                elif 'flipkart.com' in hostname: seller_name = 'Flipkart'
+                elif 'croma.com' in hostname: seller_name = 'Croma'
+                elif 'jiomart.com' in hostname: seller_name = 'JioMart'
+                elif 'vijaysales.com' in hostname: seller_name = 'Vijay Sales'
+                elif 'reliancedigital.in' in hostname: seller_name = 'Reliance Digital'
+                elif 'tatacliq.com' in hostname: seller_name = 'Tata CLiQ'
+                elif 'shopclues.com' in hostname: seller_name = 'ShopClues'
+                elif 'paytmmall.com' in hostname: seller_name = 'Paytm Mall'
+            except Exception:
+                pass
+
+        # Append result if valid data found
+        if price_str != "N/A" or seller_name != "N/A": # Basic check if we extracted *something* useful
+            results.append({
+                "seller": seller_name,
+                "title": product_title,
+                "price": price_str,
+                "link": buy_link
+            })
+
+    return results
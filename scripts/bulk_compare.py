@@ -0,0 +1,270 @@
+"""
+Bulk price comparison for a whole catalogue, outside the web app.
+
+Usage:
+    python scripts/bulk_compare.py catalogue.csv --output results.jsonl
+    python scripts/bulk_compare.py catalogue.jsonl --output results/ --format parquet --workers 8 --rate 6
+
+Input is CSV (a "url" column, or the first column) or JSONL (one URL string or
+{"url": ...} object per line). URLs are compared on a process pool, so parsing
+scales across cores, and every worker takes tokens from one shared upstream rate
+limit. Results are streamed as they finish, one per input URL and tagged with its
+input index:
+  - jsonl: the /api/compare result objects, appended to the output file.
+  - parquet: flat rows (one per URL), written as part-NNNNN.parquet files in the
+    output directory. Needs pyarrow. Rows waiting for the next part are also
+    appended to _pending.jsonl there as they finish, and folded into a part on
+    the next run if this one dies.
+The output doubles as the checkpoint: rerunning the same command skips URLs that
+already have a result, so a crashed or interrupted run resumes where it stopped.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ratelimit import SharedTokenBucket  # noqa: E402
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+TOKENS_PER_URL = 2  # BuyHatke API call + tracker page
+
+# --- Input ---
+
+def read_urls(path, url_column="url"):
+    """Returns the URLs of a CSV or JSONL file, in file order (blank entries skipped)."""
+    path = Path(path)
+    urls = []
+    with path.open(newline="", encoding="utf-8") as f:
+        if path.suffix.lower() in (".jsonl", ".ndjson"):
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                entry = json.loads(line)
+                urls.append(entry if isinstance(entry, str) else entry.get(url_column, ""))
+        else:
+            rows = csv.reader(f)
+            header = next(rows, None)
+            if header is None:
+                return []
+            column = header.index(url_column) if url_column in header else 0
+            if url_column not in header and header[0].strip().startswith("http"):
+                urls.append(header[0])  # No header row; the first line is data
+            urls.extend(row[column] for row in rows if len(row) > column)
+    return [url.strip() for url in urls if url and url.strip()]
+
+# --- Output ---
+
+def flatten(record):
+    """One columnar row for a result record."""
+    product = record.get("product") or {}
+    lowest = record.get("lowest_price_option") or {}
+    return {
+        "index": record["index"],
+        "url": record["url"],
+        "status": record["status"],
+        "error": record.get("error"),
+        "site_type": product.get("site_type"),
+        "name": product.get("name"),
+        "price": product.get("price_numeric"),
+        "lowest_seller": lowest.get("seller"),
+        "lowest_price": lowest.get("price_numeric"),
+        "lowest_is_original": bool(lowest.get("is_original")),
+        "alternatives": len(record.get("alternatives") or []),
+        "snapshot_captured_at": record.get("snapshot_captured_at"),
+    }
+
+def read_jsonl(path):
+    """The objects in a JSONL file; a torn last line from a crash is truncated away."""
+    with path.open("rb") as f:
+        data = f.read()
+    valid = data[:data.rfind(b"\n") + 1]
+    if len(valid) != len(data):
+        with path.open("r+b") as f:
+            f.truncate(len(valid))
+    return [json.loads(line) for line in valid.splitlines() if line.strip()]
+
+class JsonlWriter:
+    """Appends one JSON object per line; a torn last line from a crash is dropped on open."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.done = {}
+        if self.path.exists():
+            for record in read_jsonl(self.path):
+                self.done[record["index"]] = record["url"]
+        self._file = self.path.open("a", encoding="utf-8")
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class ParquetWriter:
+    """
+    Buffers flat rows and writes each `part_size` rows as a new part file (atomically).
+    Buffered rows are checkpointed in _pending.jsonl, which is emptied once they are in a part.
+    """
+
+    def __init__(self, directory, part_size=5000):
+        if pyarrow is None:
+            raise SystemExit("--format parquet needs pyarrow (pip install pyarrow)")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.part_size = part_size
+        self.done = {}
+        self._rows = []
+        parts = sorted(self.directory.glob("part-*.parquet"))
+        for part in parts:
+            table = pyarrow.parquet.read_table(part, columns=["index", "url"])
+            self.done.update(zip(table.column("index").to_pylist(), table.column("url").to_pylist()))
+        self._next_part = int(parts[-1].stem.split("-")[1]) + 1 if parts else 0
+
+        self._pending_path = self.directory / "_pending.jsonl"
+        if self._pending_path.exists():
+            for row in read_jsonl(self._pending_path):
+                # Already in a part if the last run died between writing it and emptying this file.
+                if row["index"] not in self.done:
+                    self._rows.append(row)
+                    self.done[row["index"]] = row["url"]
+        self._pending = self._pending_path.open("a", encoding="utf-8")
+
+    def write(self, record):
+        row = flatten(record)
+        self._rows.append(row)
+        self._pending.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self._pending.flush()
+        if len(self._rows) >= self.part_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        table = pyarrow.Table.from_pylist(self._rows)
+        path = self.directory / f"part-{self._next_part:05d}.parquet"
+        tmp = path.with_suffix(".tmp")
+        pyarrow.parquet.write_table(table, tmp)
+        os.replace(tmp, path)
+        self._next_part += 1
+        self._rows = []
+        self._pending.truncate(0)
+
+    def close(self):
+        self._flush()
+        self._pending.close()
+        self._pending_path.unlink()
+
+# --- Workers ---
+
+_limiter = None
+
+def _init_worker(limiter):
+    global _limiter
+    _limiter = limiter
+    import pipeline  # noqa: F401  Build caches and stores once per process, not per URL.
+
+def _compare_one(index, url):
+    import pipeline
+    _limiter.acquire(TOKENS_PER_URL)
+    try:
+        record = pipeline.result_to_json(url, pipeline.compare_product(url))
+    except Exception as e:
+        record = {"url": url, "status": "error", "error": f"Unexpected error: {e}"}
+    if pipeline.history_store:
+        pipeline.history_store.flush(timeout=30)  # Recorded before the URL counts as done
+    record["index"] = index
+    return record
+
+# --- Main ---
+
+class Progress:
+    def __init__(self, total, skipped, interval):
+        self.total = total
+        self.skipped = skipped
+        self.interval = interval
+        self.counts = {}
+        self.start = self.last_report = time.monotonic()
+
+    def add(self, status):
+        self.counts[status] = self.counts.get(status, 0) + 1
+        if time.monotonic() - self.last_report >= self.interval:
+            self.report()
+
+    def report(self, final=False):
+        self.last_report = now = time.monotonic()
+        done = sum(self.counts.values())
+        rate = done / (now - self.start) if now > self.start else 0.0
+        remaining = self.total - self.skipped - done
+        eta = f", ETA {remaining / rate:.0f}s" if rate and not final else ""
+        statuses = ", ".join(f"{k} {v}" for k, v in sorted(self.counts.items()))
+        print(f"{'Finished' if final else 'Progress'}: {self.skipped + done}/{self.total} "
+              f"({self.skipped} resumed), {rate:.2f} URLs/s{eta} [{statuses}]", file=sys.stderr, flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="CSV or JSONL file of product URLs")
+    parser.add_argument("--output", required=True, help="JSONL file, or directory for --format parquet")
+    parser.add_argument("--format", choices=("jsonl", "parquet"), default="jsonl")
+    parser.add_argument("--url-column", default="url", help="CSV column / JSONL key holding the URL")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="worker processes")
+    parser.add_argument("--rate", type=float, default=4.0, help="upstream requests per second across all workers (0 = unlimited)")
+    parser.add_argument("--part-size", type=int, default=5000, help="rows per parquet part file")
+    parser.add_argument("--max-snapshot-age", type=int, default=0,
+                        help="reuse stored results up to this many seconds old (default 0: always fetch)")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="seconds between progress lines")
+    args = parser.parse_args()
+
+    # Read by pipeline when the workers import it.
+    os.environ["PRICE_HISTORY_SNAPSHOT_MAX_AGE"] = str(args.max_snapshot_age)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    urls = read_urls(args.input, args.url_column)
+    writer = ParquetWriter(args.output, args.part_size) if args.format == "parquet" else JsonlWriter(args.output)
+    todo = [(i, url) for i, url in enumerate(urls) if writer.done.get(i) != url]
+    progress = Progress(len(urls), len(urls) - len(todo), args.progress_interval)
+    if not todo:
+        print(f"All {len(urls)} URLs already have results in {args.output}", file=sys.stderr)
+        writer.close()
+        return 0
+
+    limiter = SharedTokenBucket(args.rate, burst=max(TOKENS_PER_URL, args.rate))
+    max_pending = args.workers * 4  # Bounded queue so results stream out as they finish
+    pending = set()
+    items = iter(todo)
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(limiter,)) as pool:
+            while True:
+                for index, url in items:
+                    pending.add(pool.submit(_compare_one, index, url))
+                    if len(pending) >= max_pending:
+                        break
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record = future.result()
+                    writer.write(record)
+                    progress.add(record["status"])
+    except KeyboardInterrupt:
+        print("Interrupted; rerun the same command to resume.", file=sys.stderr)
+        return 130
+    finally:
+        writer.close()
+    progress.report(final=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""
+Checks that tracker_parser returns what the original app.py parser returned.
+
+Usage: python scripts/check_parser_parity.py [page.html | dir-of-saved-pages ...] [--encoding utf-8]
+
+Every page is parsed by the frozen original parser (baseline_tracker_parser.py),
+and by tracker_parser on both its fast (store-list subtree) and full-document
+paths; seller, title, price and link are compared per offer and any difference
+is printed. Exits non-zero if a page differs. Defaults to the committed corpus,
+bench/fixtures/tracker_page.html and bench/fixtures/tracker_pages/.
+
+Seller names now go through the sellers.py tables, so pages with non-canonical
+logo spellings (e.g. alt="vsales") or look-alike domains differ from the
+original in "seller" by design; the committed corpus avoids them.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from baseline_tracker_parser import scrape_alternatives  # noqa: E402
+from tracker_parser import FAST_PARSER, parse_alternatives  # noqa: E402
+
+TRACKER_URL = "https://buyhatke.com/saved-page"
+DEFAULT_CORPUS = [ROOT / "bench" / "fixtures" / "tracker_page.html", ROOT / "bench" / "fixtures" / "tracker_pages"]
+
+def collect_pages(paths):
+    pages = []
+    for path in map(Path, paths):
+        pages.extend(sorted(path.glob("*.html")) if path.is_dir() else [path])
+    return pages
+
+def offer_fields(offers):
+    return [{"seller": o.seller, "title": o.title, "price": o.price, "link": o.link} for o in offers]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", default=DEFAULT_CORPUS)
+    parser.add_argument("--encoding", default="utf-8")
+    args = parser.parse_args()
+
+    pages = collect_pages(args.paths)
+    if not pages:
+        print(f"No *.html files found in {', '.join(map(str, args.paths))}")
+        return 2
+
+    mismatches = 0
+    timings = {"baseline": 0.0, "full": 0.0, "fast": 0.0}
+    for page in pages:
+        content = page.read_bytes()
+        start = time.perf_counter()
+        expected = scrape_alternatives(content.decode(args.encoding), TRACKER_URL)
+        timings["baseline"] += time.perf_counter() - start
+        for path, fast in (("full", False), ("fast", True)):
+            start = time.perf_counter()
+            actual = offer_fields(parse_alternatives(content, TRACKER_URL, encoding=args.encoding, fast=fast))
+            timings[path] += time.perf_counter() - start
+            if actual != expected:
+                mismatches += 1
+                print(f"MISMATCH {page.name} ({path} path)\n  baseline: {expected}\n  {path}: {actual}")
+
+    print(f"{len(pages)} pages, {mismatches} mismatches (fast parser: {FAST_PARSER})")
+    print(", ".join(f"{name} parse: {total * 1000:.1f} ms total" for name, total in timings.items()))
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+import re
+from functools import lru_cache
+from urllib.parse import urlparse, parse_qs
+
+# --- Seller Tables ---
+# Both tables are plain data: add a store here and every parser path picks it up.
+
+# Registrable domain -> display name. Hostnames are matched on label boundaries,
+# so "www.croma.com" and "m.croma.com" resolve but "notcroma.com" does not.
+SELLER_DOMAINS = {
+    "amazon.in": "Amazon",
+    "amazon.com": "Amazon",
+    "flipkart.com": "Flipkart",
+    "croma.com": "Croma",
+    "jiomart.com": "JioMart",
+    "vijaysales.com": "Vijay Sales",
+    "reliancedigital.in": "Reliance Digital",
+    "tatacliq.com": "Tata CLiQ",
+    "shopclues.com": "ShopClues",
+    "paytmmall.com": "Paytm Mall",
+}
+
+# Spellings seen in logo alt text and image file names -> display name.
+# Keys are normalised with _alias_key (lowercase, letters and digits only).
+SELLER_ALIASES = {
+    "amazon": "Amazon",
+    "amazonin": "Amazon",
+    "flipkart": "Flipkart",
+    "croma": "Croma",
+    "jiomart": "JioMart",
+    "vsales": "Vijay Sales",
+    "vijaysales": "Vijay Sales",
+    "reliancedigital": "Reliance Digital",
+    "tatacliq": "Tata CLiQ",
+    "shopclues": "ShopClues",
+    "paytmmall": "Paytm Mall",
+}
+
+TRACKING_HOST = "tracking.buyhatke.com"
+
+RE_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+
+# --- Lookups ---
+
+def _alias_key(name):
+    return RE_NON_ALNUM.sub('', name.lower())
+
+def canonical_seller(name, default=None):
+    """Display name for a seller spelling, or `default` (the name itself if None) when unknown."""
+    return SELLER_ALIASES.get(_alias_key(name), name if default is None else default)
+
+@lru_cache(maxsize=4096)
+def seller_for_hostname(hostname):
+    """Seller for a hostname by longest matching domain suffix, or "N/A"."""
+    labels = hostname.lower().rstrip('.').split('.')
+    for i in range(len(labels) - 1):
+        seller = SELLER_DOMAINS.get('.'.join(labels[i:]))
+        if seller:
+            return seller
+    return "N/A"
+
+def seller_for_link(link):
+    """Seller for a buy link; BuyHatke tracking redirects are resolved to their target first."""
+    parsed = urlparse(link)
+    hostname = parsed.hostname or ""
+    if hostname == TRACKING_HOST or hostname.endswith("." + TRACKING_HOST):
+        target = parse_qs(parsed.query).get('link')
+        if target and target[0]:
+            hostname = urlparse(target[0]).hostname or ""
+    return seller_for_hostname(hostname) if hostname else "N/A"
@@ -0,0 +1,112 @@
+import asyncio
+import threading
+
+# --- Single-Flight Call Coalescing ---
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls by key: the first caller (the leader) runs the
+    function, callers arriving while it is in flight wait and receive the same
+    result, or the same exception re-raised. Nothing is cached after the call
+    completes.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Returns fn()'s result, sharing one execution among concurrent callers of the same key."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        return {"executions": self.executions, "coalesced": self.coalesced, "in_flight": self.in_flight()}
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines on one event loop: the first caller of a key starts a
+    task and concurrent callers await the same task. A caller that is cancelled (say,
+    its client disconnected) does not cancel the shared call.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key, coro_fn):
+        """Returns await coro_fn(), sharing one execution among concurrent callers of the same key."""
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(coro_fn())
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def in_flight(self):
+        return len(self._calls)
+
+    def stats(self):
+        return {"executions": self.executions, "coalesced": self.coalesced, "in_flight": self.in_flight()}
+
+
+def metric_lines(*flights):
+    """Prometheus exposition lines for one or more flight groups."""
+    metrics = (
+        ("executions_total", "counter", "Upstream calls actually executed.", lambda f: f.executions),
+        ("coalesced_total", "counter", "Callers that waited on an in-flight call instead.", lambda f: f.coalesced),
+        ("in_flight", "gauge", "Calls currently in flight.", lambda f: f.in_flight()),
+    )
+    lines = []
+    for suffix, kind, documentation, value in metrics:
+        name = f"pricecompare_singleflight_{suffix}"
+        lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+        lines += [f'{name}{{flight="{f.name}"}} {value(f)}' for f in flights]
+    return lines
@@ -0,0 +1,51 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache  # noqa: E402
+from cache import MemoryBackend, TTLCache  # noqa: E402
+
+
+@pytest.fixture
+def refresh_pool(monkeypatch):
+    """One refresh worker and no queue, so a second concurrent refresh is dropped."""
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(cache, "refresh_executor", executor)
+    monkeypatch.setattr(cache, "_refresh_slots", threading.BoundedSemaphore(1))
+    yield executor
+    executor.shutdown(wait=True)
+
+
+def stale_cache(*keys):
+    ttl_cache = TTLCache(MemoryBackend(), ttl=10, stale_ttl=100)
+    for key in keys:
+        ttl_cache.backend.set(key, "old", time.time() - 20)
+    return ttl_cache
+
+
+def test_stale_hit_refreshes_on_pool(refresh_pool):
+    ttl_cache = stale_cache("a")
+    assert ttl_cache.get_or_load("a", lambda: "new") == "old"
+    refresh_pool.shutdown(wait=True)
+    assert ttl_cache.get_or_load("a", lambda: "unused") == "new"
+    assert ttl_cache.refreshes == 1
+
+
+def test_refresh_dropped_when_pool_is_full(refresh_pool):
+    ttl_cache = stale_cache("a", "b")
+    release = threading.Event()
+    assert ttl_cache.get_or_load("a", lambda: release.wait(5) and "new") == "old"
+    assert ttl_cache.get_or_load("b", lambda: "new") == "old"
+    assert ttl_cache.refresh_drops == 1
+    assert "b" not in ttl_cache._refreshing
+
+    release.set()
+    refresh_pool.shutdown(wait=True)
+    assert ttl_cache.stats()["refreshes"] == 1
+    assert cache._refresh_slots.acquire(blocking=False)
@@ -0,0 +1,93 @@
+import os
+import sys
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import circuit  # noqa: E402
+from circuit import CircuitBreaker, UpstreamUnavailable  # noqa: E402
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(circuit, "time", fake)
+    return fake
+
+
+def make_breaker():
+    return CircuitBreaker("test", failure_threshold=3, reset_timeout=30.0, min_timeout=2.0, max_timeout=15.0,
+                          timeout_multiplier=3.0, min_samples=20)
+
+
+def upstream_call(breaker, clock, seconds):
+    """One guarded call to an upstream that answers after `seconds`."""
+    with breaker.call() as (_, read_timeout):
+        clock.now += min(seconds, read_timeout)
+        if seconds > read_timeout:
+            raise requests.exceptions.ReadTimeout("read timed out")
+
+
+def warm_up(breaker, clock):
+    for _ in range(20):
+        upstream_call(breaker, clock, 0.05)
+    assert breaker.read_timeout == 2.0
+
+
+def test_timeout_widens_read_timeout(clock):
+    breaker = make_breaker()
+    warm_up(breaker, clock)
+
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        upstream_call(breaker, clock, 3.0)
+    assert breaker.read_timeout == 4.0
+
+    upstream_call(breaker, clock, 3.0)
+    assert breaker.state == circuit.CLOSED
+
+
+def test_half_open_probe_gets_max_timeout_and_closes(clock):
+    breaker = make_breaker()
+    warm_up(breaker, clock)
+    for _ in range(3):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            with breaker.call():
+                raise requests.exceptions.ConnectionError("refused")
+    assert breaker.state == circuit.OPEN
+    assert breaker.percentile(99) is None  # Pre-outage latencies are dropped
+    with pytest.raises(UpstreamUnavailable):
+        upstream_call(breaker, clock, 0.05)
+
+    clock.now += 30.0
+    with breaker.call() as (_, read_timeout):
+        assert read_timeout == 15.0
+        clock.now += 3.0
+    assert breaker.state == circuit.CLOSED
+    assert breaker.read_timeout == 15.0  # Relearned from new samples
+
+
+def test_recovers_from_steady_slower_upstream(clock):
+    breaker = make_breaker()
+    warm_up(breaker, clock)
+
+    outcomes = []
+    for _ in range(40):
+        try:
+            upstream_call(breaker, clock, 3.0)
+            outcomes.append("ok")
+        except (requests.exceptions.Timeout, UpstreamUnavailable) as e:
+            outcomes.append(type(e).__name__)
+            clock.now += 30.0
+    assert outcomes[-20:] == ["ok"] * 20
+    assert breaker.state == circuit.CLOSED
+    assert 3.0 <= breaker.read_timeout <= 15.0
@@ -0,0 +1,150 @@
+import hashlib
+import threading
+import zlib
+from urllib.parse import urlparse
+
+# --- Tracker Page Cache ---
+# Keeps, per tracker URL, the validators (ETag / Last-Modified), the zlib-compressed
+# body and its content hash. Parsed alternatives are memoized separately by
+# (host, content hash), so a 304 or a byte-identical body never reaches the parser.
+
+class TrackerPage:
+    __slots__ = ("etag", "last_modified", "body_z", "size", "encoding", "content_hash")
+
+    def __init__(self, etag, last_modified, body_z, size, encoding, content_hash):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body_z = body_z
+        self.size = size
+        self.encoding = encoding
+        self.content_hash = content_hash
+
+    def body(self):
+        return zlib.decompress(self.body_z)
+
+    def __getstate__(self):
+        return (self.etag, self.last_modified, self.body_z, self.size, self.encoding, self.content_hash)
+
+    def __setstate__(self, state):
+        self.etag, self.last_modified, self.body_z, self.size, self.encoding, self.content_hash = state
+
+
+class TrackerPageCache:
+    """
+    Conditional-GET and parse-result cache for tracker pages.
+
+    `pages` and `parsed` are cache backends (see cache.py); pages may live in a shared
+    SQLite backend while parsed results usually stay in process memory.
+    """
+
+    def __init__(self, pages, parsed, compress_level=6):
+        self.pages = pages
+        self.parsed = parsed
+        self.compress_level = compress_level
+        self._lock = threading.Lock()
+        self.counts = {"new": 0, "changed": 0, "identical": 0, "not_modified": 0, "stale": 0,
+                       "parse_hit": 0, "parse_miss": 0, "bytes_saved": 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counts[name] += amount
+
+    def lookup(self, url):
+        """Returns the cached TrackerPage for a URL, or None."""
+        entry = self.pages.get(url)
+        return entry[0] if entry is not None else None
+
+    @staticmethod
+    def conditional_headers(page):
+        """If-None-Match / If-Modified-Since headers for a cached page (or {})."""
+        if page is None:
+            return {}
+        headers = {}
+        if page.etag:
+            headers["If-None-Match"] = page.etag
+        if page.last_modified:
+            headers["If-Modified-Since"] = page.last_modified
+        return headers
+
+    def alternatives_for(self, url, cached, response, parse_func, now):
+        """
+        Resolves a response to a parsed alternatives list. `cached` is the page from
+        lookup() whose validators were sent, so a 304 is answered from it.
+        parse_func(body_bytes, encoding) is only called when no memoized result exists.
+        """
+        if response.status_code == 304:
+            if cached is None:
+                raise ValueError(f"304 Not Modified for {url} without a cached page")
+            self._count("not_modified")
+            self._count("bytes_saved", cached.size)
+            page = cached
+            if response.headers.get("ETag"):
+                page.etag = response.headers["ETag"]
+            self.pages.set(url, page, now)  # refresh LRU position / stored_at
+        else:
+            body = response.content
+            content_hash = hashlib.blake2b(body, digest_size=16).hexdigest()
+            if cached is not None and cached.content_hash == content_hash:
+                self._count("identical")
+                page = cached
+            else:
+                self._count("changed" if cached is not None else "new")
+                page = TrackerPage(None, None, zlib.compress(body, self.compress_level), len(body),
+                                   response.encoding, content_hash)
+            page.etag = response.headers.get("ETag")
+            page.last_modified = response.headers.get("Last-Modified")
+            self.pages.set(url, page, now)
+
+        return self._parsed(url, page, parse_func, now)
+
+    def last_known(self, url, parse_func, now):
+        """
+        Alternatives from the cached copy of a page without contacting upstream, or None
+        when nothing is cached. Used while the tracker page circuit is open.
+        """
+        page = self.lookup(url)
+        if page is None:
+            return None
+        self._count("stale")
+        return self._parsed(url, page, parse_func, now)
+
+    def _parsed(self, url, page, parse_func, now):
+        memo_key = f"{urlparse(url).netloc}:{page.content_hash}"
+        memo = self.parsed.get(memo_key)
+        if memo is not None:
+            self._count("parse_hit")
+            return memo[0]
+
+        self._count("parse_miss")
+        alternatives = parse_func(page.body(), page.encoding)
+        self.parsed.set(memo_key, alternatives, now)
+        return alternatives
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counts)
+        stats["pages"], stats["page_bytes"] = self.pages.size()
+        stats["parsed_entries"], _ = self.parsed.size()
+        return stats
+
+    def metric_lines(self):
+        stats = self.stats()
+        lines = [
+            "# HELP pricecompare_tracker_page_responses_total Tracker page fetches by cache outcome.",
+            "# TYPE pricecompare_tracker_page_responses_total counter",
+        ]
+        for result in ("new", "changed", "identical", "not_modified", "stale"):
+            lines.append(f'pricecompare_tracker_page_responses_total{{result="{result}"}} {stats[result]}')
+        lines += [
+            "# HELP pricecompare_tracker_parse_memo_total Parsed-result memo lookups.",
+            "# TYPE pricecompare_tracker_parse_memo_total counter",
+            f'pricecompare_tracker_parse_memo_total{{result="hit"}} {stats["parse_hit"]}',
+            f'pricecompare_tracker_parse_memo_total{{result="miss"}} {stats["parse_miss"]}',
+            "# HELP pricecompare_tracker_bytes_saved_total Page bytes not downloaded thanks to 304 responses.",
+            "# TYPE pricecompare_tracker_bytes_saved_total counter",
+            f"pricecompare_tracker_bytes_saved_total {stats['bytes_saved']}",
+            "# HELP pricecompare_tracker_cache_bytes Compressed tracker page bytes stored.",
+            "# TYPE pricecompare_tracker_cache_bytes gauge",
+            f"pricecompare_tracker_cache_bytes {stats['page_bytes']}",
+        ]
+        return lines
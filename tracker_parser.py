@@ -0,0 +1,188 @@
+import html
+import logging
+import re
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from offers import Offer, to_paise
+from sellers import canonical_seller, seller_for_link
+
+logger = logging.getLogger(__name__)
+
+# --- Parser Selection ---
+# lxml builds trees several times faster than html.parser; fall back to the
+# pure-Python parser when it isn't installed.
+try:
+    import lxml  # noqa: F401
+    FAST_PARSER = "lxml"
+except ImportError:
+    FAST_PARSER = "html.parser"
+
+LEGACY_PARSER = "html.parser"
+
+# Only the store list subtree is materialised on the fast path.
+STORES_SECTION_STRAINER = SoupStrainer("section", id="onlineStoresList")
+
+# --- Precompiled Selectors ---
+RE_PRICE_LIST = re.compile(r'my-4 grid')
+RE_IMG_CONTAINER = re.compile(r'\bflex\b.*\bitems-center\b')
+RE_ROUNDED_FULL = re.compile(r'\brounded-full\b')
+RE_SELLER_FROM_SRC = re.compile(r'/([^/]+?)(?:1|_m)?\.(?:png|jpe?g|webp|svg)', re.IGNORECASE)
+RE_PRICE_CONTAINER = re.compile(r'flex justify-between')
+RE_RUPEE = re.compile(r'₹')
+RE_NUMBER = re.compile(r'([\d,]+(?:\.\d+)?)')
+RE_RUPEE_NUMBER = re.compile(r'₹\s*([\d,]+(?:\.\d+)?)')
+RE_TEXT_PRIMARY = re.compile(r'\btext-primary\b')
+RE_BUY = re.compile(r'Buy')
+
+def _is_found_more_prices(text):
+    return text and "Found" in text and "more prices" in text
+
+# --- Price List Lookup ---
+
+def _find_price_list_fast(content, encoding):
+    """Parses only section#onlineStoresList. Returns the <ul> or None."""
+    soup = BeautifulSoup(content, FAST_PARSER, parse_only=STORES_SECTION_STRAINER, from_encoding=encoding)
+    section = soup.find('section', id='onlineStoresList')
+    if section:
+        return section.find('ul', class_=RE_PRICE_LIST)
+    return None
+
+def _find_price_list_full(content, encoding):
+    """Full-document parse with the id, heading-text and generic fallbacks."""
+    soup = BeautifulSoup(content, LEGACY_PARSER, from_encoding=encoding)
+
+    price_list = None
+    # Try specific ID first
+    price_section_by_id = soup.find('section', id='onlineStoresList')
+    if price_section_by_id:
+        price_list = price_section_by_id.find('ul', class_=RE_PRICE_LIST)
+
+    # Try common structure/text if ID fails
+    if not price_list:
+        price_section_by_text = soup.find('section', class_='grid', string=_is_found_more_prices)
+        if price_section_by_text:
+            price_list = price_section_by_text.find('ul', class_=RE_PRICE_LIST)
+
+    # Generic fallback if specific methods fail
+    if not price_list:
+        price_list = soup.find('ul', class_=RE_PRICE_LIST) # First match is assumed correct
+
+    return price_list
+
+# --- Item Extraction ---
+
+def parse_item(item, tracker_url):
+    """Extracts seller, title, price and link from one <li>. Returns an Offer or None."""
+    seller_name = "N/A"
+    product_title = "N/A"
+    price_str = "N/A"
+    price_paise = None
+    buy_link = "#" # Default link to avoid errors
+
+    # Seller Name Extraction
+    img_container = item.find('div', class_=RE_IMG_CONTAINER)
+    if img_container:
+        img_tag = img_container.find('img', class_=RE_ROUNDED_FULL, alt=True)
+        if img_tag and img_tag.get('alt'):
+            seller_name = canonical_seller(img_tag['alt'].strip())
+    if seller_name == "N/A" and img_container: # Fallback to src parsing
+        img_tag = img_container.find('img', class_=RE_ROUNDED_FULL, src=True)
+        if img_tag:
+            match = RE_SELLER_FROM_SRC.search(img_tag.get('src', ''))
+            if match:
+                slug = match.group(1)
+                seller_name = canonical_seller(slug, default=slug.replace('-', ' ').replace('_', ' ').title())
+
+    # Product Title Extraction
+    title_p_tag = item.find('p', title=True)
+    if title_p_tag:
+        product_title = html.unescape(title_p_tag['title'].strip())
+    else:
+        title_p_tag = item.find('p', class_='capitalize')
+        if title_p_tag:
+            # Prioritize the longer title if available (often more complete)
+            span_hidden_md = title_p_tag.find('span', class_='hidden md:inline')
+            span_md_hidden = title_p_tag.find('span', class_='md:hidden')
+            if span_hidden_md and len(span_hidden_md.get_text(strip=True)) > 5: # Check length as heuristic
+                product_title = html.unescape(span_hidden_md.get_text(strip=True))
+            elif span_md_hidden:
+                product_title = html.unescape(span_md_hidden.get_text(strip=True))
+            else: # Fallback to the whole paragraph text
+                product_title = html.unescape(title_p_tag.get_text(strip=True))
+
+    # Price Extraction
+    price_container = item.find('div', class_=RE_PRICE_CONTAINER)
+    if price_container:
+        price_span = price_container.find('span', class_='font-bold')
+        if price_span:
+            raw_price = price_span.get_text(strip=True)
+            price_match = RE_NUMBER.search(raw_price)
+            price_str = f"₹{price_match.group(1)}" if price_match else raw_price
+            price_paise = to_paise(price_match.group(1)) if price_match else None
+        else:
+            price_p_tag = price_container.find('p', string=RE_RUPEE)
+            if price_p_tag:
+                raw_price = price_p_tag.get_text(strip=True)
+                price_match = RE_RUPEE_NUMBER.search(raw_price)
+                price_str = f"₹{price_match.group(1)}" if price_match else raw_price
+                price_paise = to_paise(price_match.group(1)) if price_match else None
+
+    # Buy Link Extraction: price container first, then the whole list item
+    if price_container:
+        buy_a_tag = price_container.find('a', href=True, class_=RE_TEXT_PRIMARY)
+        if not buy_a_tag: buy_a_tag = price_container.find('a', href=True, string=RE_BUY)
+        if buy_a_tag: buy_link = buy_a_tag['href']
+    if buy_link == "#":
+        buy_a_tag = item.find('a', href=True, string=RE_BUY)
+        if buy_a_tag: buy_link = buy_a_tag['href']
+
+    # Resolve relative URLs
+    if buy_link.startswith('/'):
+        buy_link = urljoin(tracker_url, buy_link)
+
+    # Final Fallback: Seller from Buy Link Hostname
+    if seller_name == "N/A" and buy_link != "#" and buy_link.startswith("http"):
+        try:
+            seller_name = seller_for_link(buy_link)
+        except ValueError: # Malformed URL
+            pass
+
+    if price_str == "N/A" and seller_name == "N/A": # Nothing useful extracted
+        return None
+    return Offer(seller_name, product_title, price_str, buy_link, price_paise)
+
+# --- Public Entry Point ---
+
+def iter_offers(content, tracker_url, encoding=None, fast=True):
+    """
+    Parses a tracker page (bytes or str) and yields an Offer per alternative price.
+    With fast=True only section#onlineStoresList is parsed; the full-document
+    parse is used only when that section or its list is missing.
+    Yields nothing if no list or items were found.
+    """
+    if isinstance(content, str):
+        encoding = None # Already decoded
+    price_list = _find_price_list_fast(content, encoding) if fast else None
+    if not price_list:
+        price_list = _find_price_list_full(content, encoding)
+
+    if not price_list:
+        logger.warning("Could not find the list (<ul>) of alternative prices. Scraping patterns might need update.")
+        return
+
+    list_items = price_list.find_all('li', recursive=False)
+    if not list_items:
+        logger.info("No alternative price list items (<li>) found within the list.")
+        return
+
+    logger.debug("Found %d alternative price items", len(list_items))
+    for item in list_items:
+        offer = parse_item(item, tracker_url)
+        if offer is not None:
+            yield offer
+
+def parse_alternatives(content, tracker_url, encoding=None, fast=True):
+    """Like iter_offers, but returns the offers as a list (empty if none were found)."""
+    return list(iter_offers(content, tracker_url, encoding=encoding, fast=fast))
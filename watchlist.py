@@ -0,0 +1,338 @@
+import collections
+import fcntl
+import heapq
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from observability import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+WATCHLIST_REFRESHES = Counter("pricecompare_watchlist_refreshes_total", "Watchlist refreshes by outcome.", ["outcome"])
+WATCHLIST_REFRESH_SECONDS = Histogram("pricecompare_watchlist_refresh_seconds", "Time to refresh one watched product.")
+PRICE_DROP_EVENTS = Counter("pricecompare_price_drop_events_total", "Price-drop events emitted by the watchlist.")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS watchlist (
+    product_key TEXT PRIMARY KEY,
+    site_type TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    threshold_paise INTEGER,
+    added_at REAL NOT NULL,
+    last_refreshed_at REAL,
+    last_lowest_paise INTEGER,
+    last_lowest_seller TEXT,
+    popularity REAL NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_watchlist_refreshed ON watchlist (last_refreshed_at);
+CREATE TABLE IF NOT EXISTS price_drop_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_key TEXT NOT NULL,
+    url TEXT NOT NULL,
+    seller TEXT,
+    lowest_paise INTEGER NOT NULL,
+    previous_paise INTEGER,
+    threshold_paise INTEGER,
+    at REAL NOT NULL
+);
+"""
+
+# --- Watchlist Storage ---
+
+class Watchlist:
+    """Watched products in SQLite, shared by every worker process on the host."""
+
+    def __init__(self, path, popularity_flush_interval=30.0):
+        self.path = path
+        self.popularity_flush_interval = popularity_flush_interval
+        self._local = threading.local()
+        self._pending_popularity = collections.Counter()
+        self._popularity_lock = threading.Lock()
+        self._flusher = None
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, product_key, site_type, product_id, url, threshold_paise=None):
+        """Adds a product, or updates its URL/threshold if it is already watched."""
+        self._conn().execute(
+            "INSERT INTO watchlist (product_key, site_type, product_id, url, threshold_paise, added_at) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(product_key) DO UPDATE SET url = excluded.url, threshold_paise = excluded.threshold_paise",
+            (product_key, site_type, product_id, url, threshold_paise, time.time()),
+        )
+
+    def remove(self, product_key):
+        """Returns True if the product was being watched."""
+        return self._conn().execute("DELETE FROM watchlist WHERE product_key = ?", (product_key,)).rowcount > 0
+
+    def get(self, product_key):
+        row = self._conn().execute("SELECT * FROM watchlist WHERE product_key = ?", (product_key,)).fetchone()
+        return dict(row) if row else None
+
+    def entries(self, limit=1000, offset=0):
+        rows = self._conn().execute(
+            "SELECT * FROM watchlist ORDER BY added_at LIMIT ? OFFSET ?", (limit, offset)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM watchlist").fetchone()[0]
+
+    def due_entries(self, now, refresh_interval, limit):
+        """Entries whose last refresh is older than refresh_interval and not backing off."""
+        rows = self._conn().execute(
+            "SELECT * FROM watchlist WHERE (last_refreshed_at IS NULL OR last_refreshed_at <= ?) "
+            "AND next_attempt_at <= ? ORDER BY last_refreshed_at IS NOT NULL, last_refreshed_at LIMIT ?",
+            (now - refresh_interval, now, limit),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def mark_refreshed(self, product_key, lowest_paise, lowest_seller, now):
+        self._conn().execute(
+            "UPDATE watchlist SET last_refreshed_at = ?, last_lowest_paise = ?, last_lowest_seller = ?, "
+            "failures = 0, next_attempt_at = 0 WHERE product_key = ?",
+            (now, lowest_paise, lowest_seller, product_key),
+        )
+
+    def mark_failed(self, product_key, retry_at):
+        self._conn().execute(
+            "UPDATE watchlist SET failures = failures + 1, next_attempt_at = ? WHERE product_key = ?",
+            (retry_at, product_key),
+        )
+
+    # --- Price-Drop Events ---
+    # Kept in the shared database so any worker can serve them, not just the one
+    # running the scheduler; only the newest `keep` rows are retained.
+
+    def add_event(self, event, keep=500):
+        conn = self._conn()
+        conn.execute("BEGIN")
+        conn.execute(
+            "INSERT INTO price_drop_events (product_key, url, seller, lowest_paise, previous_paise, threshold_paise, at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (event["product_key"], event["url"], event["seller"], event["lowest_paise"],
+             event["previous_paise"], event["threshold_paise"], event["at"]),
+        )
+        conn.execute("DELETE FROM price_drop_events WHERE id <= last_insert_rowid() - ?", (keep,))
+        conn.execute("COMMIT")
+
+    def recent_events(self, limit=500):
+        """The newest `limit` price-drop events, oldest first, prices in rupees."""
+        rows = self._conn().execute(
+            "SELECT * FROM price_drop_events ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [event_to_json(dict(row)) for row in reversed(rows)]
+
+    # --- Popularity ---
+    # Interactive lookups only bump an in-memory counter; a background thread adds
+    # the counts to the table in one transaction every popularity_flush_interval.
+
+    def note_request(self, product_key):
+        with self._popularity_lock:
+            self._pending_popularity[product_key] += 1
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="watchlist-popularity", daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.popularity_flush_interval)
+            try:
+                self.flush_popularity()
+            except sqlite3.Error:
+                logger.exception("Failed to flush watchlist popularity")
+
+    def flush_popularity(self):
+        with self._popularity_lock:
+            pending, self._pending_popularity = self._pending_popularity, collections.Counter()
+        if not pending:
+            return
+        conn = self._conn()
+        conn.execute("BEGIN")
+        conn.executemany("UPDATE watchlist SET popularity = popularity + ? WHERE product_key = ?",
+                         [(count, key) for key, count in pending.items()])
+        conn.execute("COMMIT")
+
+    def decay_popularity(self, factor):
+        self._conn().execute("UPDATE watchlist SET popularity = popularity * ? WHERE popularity > 0", (factor,))
+
+def event_to_json(event):
+    def rupees(paise):
+        return paise / 100 if paise is not None else None
+    return {
+        "product_key": event["product_key"],
+        "url": event["url"],
+        "seller": event["seller"],
+        "lowest_price": rupees(event["lowest_paise"]),
+        "previous_price": rupees(event["previous_paise"]),
+        "threshold": rupees(event["threshold_paise"]),
+        "at": event["at"],
+    }
+
+# --- Scheduler ---
+
+class WatchlistScheduler:
+    """
+    Refreshes due watchlist entries on a worker pool.
+
+    Entries are prioritised by staleness (multiples of refresh_interval since the last
+    refresh) weighted by popularity, and every refresh takes `tokens_per_refresh`
+    tokens from the shared upstream rate limiter. `refresh_func(entry)` must return
+    (lowest_paise, lowest_seller) or raise on failure.
+    """
+
+    def __init__(self, watchlist, refresh_func, rate_limiter, workers=4, refresh_interval=1800,
+                 poll_interval=1.0, tokens_per_refresh=2, drop_percent=5.0, max_backoff=3600,
+                 popularity_half_life=86400, events_retention=500):
+        self.watchlist = watchlist
+        self.refresh_func = refresh_func
+        self.rate_limiter = rate_limiter
+        self.workers = workers
+        self.refresh_interval = refresh_interval
+        self.poll_interval = poll_interval
+        self.tokens_per_refresh = tokens_per_refresh
+        self.drop_percent = drop_percent
+        self.max_backoff = max_backoff
+        self.popularity_half_life = popularity_half_life
+        self.events_retention = events_retention
+        self._listeners = []
+        self._inflight = set()
+        self._inflight_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = None
+
+    def add_listener(self, func):
+        """Calls func(event) for every price-drop event."""
+        self._listeners.append(func)
+        return func
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="watchlist")
+        self._thread = threading.Thread(target=self._run, name="watchlist-scheduler", daemon=True)
+        self._thread.start()
+        logger.info("Watchlist scheduler started workers=%d interval=%ss", self.workers, self.refresh_interval)
+
+    def stop(self, wait=True):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+    def _priority(self, entry, now):
+        last = entry["last_refreshed_at"]
+        staleness = (now - last) / self.refresh_interval if last else float("inf")
+        return staleness * (1.0 + math.log1p(entry["popularity"]))
+
+    def _run(self):
+        decay_every = self.popularity_half_life / 24
+        last_decay = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                with self._inflight_lock:
+                    free = self.workers - len(self._inflight)
+                if free > 0:
+                    now = time.time()
+                    candidates = [e for e in self.watchlist.due_entries(now, self.refresh_interval, limit=free * 20)
+                                  if e["product_key"] not in self._inflight]
+                    for entry in heapq.nlargest(free, candidates, key=lambda e: self._priority(e, now)):
+                        with self._inflight_lock:
+                            self._inflight.add(entry["product_key"])
+                        self._executor.submit(self._refresh, entry)
+                if time.monotonic() - last_decay > decay_every:
+                    last_decay = time.monotonic()
+                    self.watchlist.decay_popularity(0.5 ** (1 / 24))
+            except Exception:
+                logger.exception("Watchlist scheduler iteration failed")
+            self._stop.wait(self.poll_interval)
+
+    def _refresh(self, entry):
+        key = entry["product_key"]
+        try:
+            self.rate_limiter.acquire(self.tokens_per_refresh)
+            start = time.perf_counter()
+            try:
+                lowest_paise, lowest_seller = self.refresh_func(entry)
+            finally:
+                WATCHLIST_REFRESH_SECONDS.observe(time.perf_counter() - start)
+            self.watchlist.mark_refreshed(key, lowest_paise, lowest_seller, time.time())
+            WATCHLIST_REFRESHES.inc(outcome="ok")
+            self._check_price_drop(entry, lowest_paise, lowest_seller)
+        except Exception as e:
+            backoff = min(self.max_backoff, 60 * (2 ** entry["failures"]))
+            self.watchlist.mark_failed(key, time.time() + backoff)
+            WATCHLIST_REFRESHES.inc(outcome="error")
+            logger.warning("Watchlist refresh failed for %s (retry in %ss): %s", key, backoff, e)
+        finally:
+            with self._inflight_lock:
+                self._inflight.discard(key)
+
+    def _check_price_drop(self, entry, lowest_paise, lowest_seller):
+        if lowest_paise is None:
+            return
+        previous = entry["last_lowest_paise"]
+        threshold = entry["threshold_paise"]
+        if threshold is not None:
+            dropped = lowest_paise < threshold and (previous is None or previous >= threshold)
+        else:
+            dropped = previous is not None and lowest_paise <= previous * (1 - self.drop_percent / 100)
+        if not dropped:
+            return
+
+        row = {
+            "product_key": entry["product_key"],
+            "url": entry["url"],
+            "seller": lowest_seller,
+            "lowest_paise": lowest_paise,
+            "previous_paise": previous,
+            "threshold_paise": threshold,
+            "at": time.time(),
+        }
+        try:
+            self.watchlist.add_event(row, keep=self.events_retention)
+        except sqlite3.Error:
+            logger.exception("Failed to store price-drop event for %s", row["product_key"])
+        event = event_to_json(row)
+        PRICE_DROP_EVENTS.inc()
+        logger.info("Price drop %s: %s -> %s at %s", event["product_key"], event["previous_price"],
+                    event["lowest_price"], lowest_seller)
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception:
+                logger.exception("Price-drop listener failed")
+
+# --- Single Scheduler per Host ---
+
+def acquire_scheduler_lock(path):
+    """
+    Takes a non-blocking exclusive lock so only one gunicorn worker runs the scheduler.
+    Returns the open lock file (keep a reference for the life of the process) or None.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return os.fdopen(fd, "r+")